@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Server side cost of the global snapshot: --collect sys vs --collect pfs
+
+Runs QueryThread.get_global() against a local MySQL for every mode and reads
+what the collector connection cost the server from
+performance_schema.events_statements_summary_by_thread_by_event_name,
+through a second connection.
+
+  python bench/bench_collect_modes.py -u root -P secret -c 50
+"""
+
+import argparse
+import getpass
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysql.connector as Database
+
+import mysqlstatus
+
+COST_SQL = """
+SELECT sum(s.COUNT_STAR) as statements,
+       sum(s.SUM_TIMER_WAIT) as timer_wait,
+       sum(s.SUM_LOCK_TIME) as lock_time,
+       sum(s.SUM_ROWS_EXAMINED) as rows_examined,
+       sum(s.SUM_ROWS_SENT) as rows_sent,
+       sum(s.SUM_CREATED_TMP_TABLES) as tmp_tables,
+       sum(s.SUM_CREATED_TMP_DISK_TABLES) as tmp_disk_tables,
+       sum(s.SUM_SORT_ROWS) as sort_rows
+  FROM performance_schema.events_statements_summary_by_thread_by_event_name s
+  JOIN performance_schema.threads t on t.THREAD_ID = s.THREAD_ID
+ WHERE t.PROCESSLIST_ID = %s
+"""
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-h", "--host", default="localhost", type=str)
+    parser.add_argument("-p", "--port", default=3306, type=int)
+    parser.add_argument("-u", "--user", default=getpass.getuser(), type=str)
+    parser.add_argument("-P", "--password", default='', type=str)
+    parser.add_argument("-c", "--count", default=20, type=int,
+        help="Snapshots per mode.")
+    parser.add_argument("--help", default=False, action='store_true')
+    return parser
+
+
+def connect(options):
+    return Database.connect(
+        host=options.host,
+        user=options.user,
+        port=options.port,
+        passwd=options.password,
+        connection_timeout=10)
+
+
+def server_cost(observer, connection_id):
+    cursor = observer.cursor(dictionary=True)
+    cursor.execute(COST_SQL, (connection_id,))
+    row = cursor.fetchall()[0]
+    cursor.close()
+    return dict((k, float(v or 0)) for k, v in row.items())
+
+
+def bench_mode(options, observer, collect):
+    db = connect(options)
+    qthread = mysqlstatus.QueryThread(db=db, dbhost=options.host, collect=collect)
+
+    before = server_cost(observer, db.connection_id)
+    started = time.time()
+    for _ in range(options.count):
+        # every field is due on every snapshot
+        qthread._global_refreshed.clear()
+        qthread.get_global()
+    elapsed = time.time() - started
+    after = server_cost(observer, db.connection_id)
+    qthread.cleanup_mysql()
+
+    cost = dict((k, (after[k] - before[k]) / options.count) for k in after)
+    cost['wall_ms'] = elapsed * 1000 / options.count
+    return cost
+
+
+if __name__ == '__main__':
+    parser = get_args_parser()
+    options = parser.parse_args()
+    if options.help:
+        parser.print_help()
+        parser.exit()
+
+    observer = connect(options)
+    results = {}
+    for collect in ('sys', 'pfs'):
+        results[collect] = bench_mode(options, observer, collect)
+    observer.close()
+
+    print("per snapshot, %d snapshots per mode" % options.count)
+    print("%-18s %14s %14s" % ('', 'sys', 'pfs'))
+    print("%-18s %14.2f %14.2f" % ('wall(ms)', results['sys']['wall_ms'], results['pfs']['wall_ms']))
+    print("%-18s %14.2f %14.2f" % ('server(ms)', results['sys']['timer_wait'] / 1e9, results['pfs']['timer_wait'] / 1e9))
+    print("%-18s %14.2f %14.2f" % ('lock(ms)', results['sys']['lock_time'] / 1e9, results['pfs']['lock_time'] / 1e9))
+    for key in ('statements', 'rows_examined', 'rows_sent', 'tmp_tables', 'tmp_disk_tables', 'sort_rows'):
+        print("%-18s %14.1f %14.1f" % (key, results['sys'][key], results['pfs'][key]))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per tick cost of the collector and sink hot paths, without MySQL or ES
+
+Every simulated instance is a QueryThread on a fake connection answering
+from bench/fixtures, shipped by a SendMode whose client is a fake
+Elasticsearch. Prints per stage latency (mean/p95 per call), allocations
+per call and the end to end throughput in samples per second.
+
+  python bench/bench_pipeline.py
+  python bench/bench_pipeline.py --instances 1,100 --rounds 10 --no-alloc
+"""
+
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+from fakes import FakeConnection, FakeElasticsearch, FakeServer
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--instances", default='1,100,1000', type=str,
+        help="Comma separated simulated instance counts.")
+    parser.add_argument("--rounds", default=5, type=int,
+        help="Collection ticks per instance count.")
+    parser.add_argument("--no-alloc", default=False, action='store_true',
+        help="Skip the tracemalloc pass.")
+    return parser
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.times = []
+        self.allocated = []
+
+    def run(self, func, *args, trace=False):
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = func(*args)
+            self.allocated.append(tracemalloc.get_traced_memory()[1] - before)
+            return result
+        started = time.perf_counter()
+        result = func(*args)
+        self.times.append(time.perf_counter() - started)
+        return result
+
+    def report(self):
+        times = sorted(self.times)
+        mean = sum(times) / len(times) * 1e6 if times else 0
+        p95 = times[int(len(times) * 0.95) - 1] * 1e6 if times else 0
+        alloc = sum(self.allocated) / len(self.allocated) / 1024 if self.allocated else float('nan')
+        return "%-22s %12.1f %12.1f %14.1f" % (self.name, mean, p95, alloc)
+
+
+def make_sink():
+    options = mysqlstatus.get_args_parser().parse_args([])
+    sink = mysqlstatus.SendMode.__new__(mysqlstatus.SendMode)
+    sink.options = options
+    sink.elkconf = {'elk': {'docmap': {'status': os.path.join(ROOT, 'status_map.json'),
+                                       'global': os.path.join(ROOT, 'global_map.json')}}}
+    sink.elkconn = FakeElasticsearch()
+    sink.load_mappings()
+    sink.shipper = mysqlstatus.BulkShipper(sink.elkconn)
+    return sink
+
+
+def run(count, rounds, trace):
+    server = FakeServer()
+    stages = dict((name, Stage(name)) for name in (
+        'to_dict(variables)', 'get_status', 'get_query_per_second', 'get_global',
+        'get_procesesslist', 'collect(status)', 'send_update_status',
+        'send_update_global', 'bulk flush'))
+    qthreads = [mysqlstatus.QueryThread(db=FakeConnection(server), dbhost='db%04d' % i,
+                                        samples=mysqlstatus.SampleQueue(maxsize=1))
+                for i in range(count)]
+    sink = make_sink()
+
+    shipped = 0
+    pipeline = 0.0
+    for tick in range(rounds):
+        server.advance()
+        # the first tick sizes the buffers that later ticks reuse, it is not traced
+        traced = trace and tick > 0
+        for qthread in qthreads:
+            stages['to_dict(variables)'].run(qthread.to_dict, server.variables, trace=traced)
+            stages['get_status'].run(qthread.get_status, trace=traced)
+            stages['get_query_per_second'].run(qthread.get_query_per_second, trace=traced)
+            qthread._global_refreshed.clear()
+            stages['get_global'].run(qthread.get_global, trace=traced)
+            stages['get_procesesslist'].run(qthread.get_procesesslist, trace=traced)
+
+        # end to end: collect a status sample and ship it, then a global one
+        started = time.perf_counter()
+        for qthread in qthreads:
+            qthread.mode = 'status'
+            stages['collect(status)'].run(qthread.collect, trace=traced)
+            sample = qthread._samples.get(timeout=0)
+            stages['send_update_status'].run(sink.send_update_status, sample, trace=traced)
+            qthread.mode = 'global'
+            qthread.collect()
+            sample = qthread._samples.get(timeout=0)
+            stages['send_update_global'].run(sink.send_update_global, sample, trace=traced)
+            shipped += 2
+        stages['bulk flush'].run(sink.shipper.flush, trace=traced)
+        pipeline += time.perf_counter() - started
+    sink.shipper.close()
+
+    return stages, shipped / pipeline if pipeline else 0, sink
+
+
+if __name__ == '__main__':
+    options = get_args_parser().parse_args()
+    for count in [int(c) for c in options.instances.split(',')]:
+        stages, throughput, sink = run(count, options.rounds, trace=False)
+        if not options.no_alloc:
+            tracemalloc.start()
+            alloc_stages, _, _ = run(count, 3, trace=True)
+            tracemalloc.stop()
+            for name, stage in stages.items():
+                stage.allocated = alloc_stages[name].allocated
+
+        print("== %d instance(s), %d rounds" % (count, options.rounds))
+        print("%-22s %12s %12s %14s" % ('stage', 'mean(us)', 'p95(us)', 'alloc(KiB)'))
+        for stage in stages.values():
+            print(stage.report())
+        print("throughput: %.0f samples/s, %d bulk requests, %.1f KiB shipped"
+              % (throughput, sink.elkconn.requests, sink.elkconn.bytes / 1024.0))
+        print(sink.shipper.report())
+        print()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cold start import cost of mysqlstatus per mode
+
+Every mode runs in a fresh interpreter with -X importtime: the module is
+imported and the client libraries the mode loads lazily are touched. Prints
+the total import time per mode (best of --rounds) and the heaviest modules,
+and exits 1 when a mode is over --max-ms so a regression fails a CI job.
+
+  python bench/bench_startup.py
+  python bench/bench_startup.py --rounds 10 --max-ms 150
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# mode, lazily imported modules it touches
+MODES = (
+    ('import', ()),
+    ('cli', ('Database',)),
+    ('interactive', ('Database', 'curses', 'pytz')),
+    ('elk', ('Database', 'yaml', 'elasticsearch')),
+    ('exporter', ('Database', 'http_server')),
+    ('fleet', ('Database', 'yaml')),
+)
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", default=5, type=int,
+        help="Interpreter starts per mode, the fastest one is reported.")
+    parser.add_argument("--top", default=5, type=int,
+        help="Heaviest modules to list per mode.")
+    parser.add_argument("--max-ms", default=0, type=float,
+        help="Exit 1 when a mode imports slower than this(0: off).")
+    return parser
+
+
+def import_times(code):
+    """ one cold start running code -> {module: (self us, cumulative us)} """
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                          cwd=ROOT, capture_output=True, text=True, check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def main():
+    options = get_args_parser().parse_args()
+    # what the interpreter imports by itself is not ours
+    baseline = set(import_times("pass"))
+    failed = False
+
+    print("%-12s %10s  %s" % ('mode', 'total(ms)', 'heaviest(cumulative ms)'))
+    for mode, touch in MODES:
+        best = None
+        for _ in range(options.rounds):
+            times = import_times("import mysqlstatus\n" + "".join(
+                "mysqlstatus.%s.__name__\n" % name for name in touch))
+            total = sum(own for name, (own, _) in times.items() if name not in baseline)
+            if best is None or total < best[0]:
+                best = (total, times)
+        total, times = best
+        top = sorted(((cumulative, name) for name, (_, cumulative) in times.items()
+                      if '.' not in name and name not in baseline),
+                     reverse=True)[:options.top]
+        print("%-12s %10.1f  %s" % (mode, total / 1000.0,
+              ", ".join("%s %.1f" % (name, cumulative / 1000.0) for cumulative, name in top)))
+        if options.max_ms and total / 1000.0 > options.max_ms:
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
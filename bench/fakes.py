@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+In-process stand-ins for mysql.connector and the Elasticsearch client,
+answering from the recorded fixtures in bench/fixtures.
+"""
+
+import json
+import os
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), 'r') as fp:
+        return json.load(fp)
+
+
+class FakeServer:
+    """One recorded server shared by every fake connection.
+
+    advance() moves the counters on by one tick; it is meant to be called
+    outside the timed section, so the fake costs nothing while measuring.
+    """
+
+    def __init__(self):
+        self.status = load_fixture('show_global_status.json')
+        self.variables = load_fixture('show_variables.json')
+        self.processlist = load_fixture('processlist.json')
+        self.glob = load_fixture('global.json')
+        self.tick = 0
+        self.version = dict((row['Variable_name'], row['Value']) for row in self.variables).get('version', '8.0.34')
+        self.status_rows = self.status
+        self._counters = [i for i, row in enumerate(self.status)
+                          if row['Value'].isdigit() and row['Value'] != '0']
+
+    def advance(self):
+        self.tick += 1
+        rows = [dict(row) for row in self.status]
+        for step, i in enumerate(self._counters):
+            rows[i]['Value'] = str(int(rows[i]['Value']) + self.tick * (step % 97 + 1))
+        self.status_rows = rows
+
+    def answer(self, sql):
+        upper = sql.upper()
+        if upper.startswith('SHOW GLOBAL STATUS'):
+            return self.status_rows
+        if upper.startswith('SHOW VARIABLES') or upper.startswith('SHOW GLOBAL VARIABLES'):
+            return self.variables
+        if 'EVENTS_STATEMENTS_SUMMARY_BY_DIGEST' in upper and not upper.startswith('SELECT AVG_TIMER_WAIT'):
+            return []
+        if 'PROCESSLIST' in upper and 'COUNT(1)' not in upper:
+            return self.processlist
+        if upper.startswith('SELECT AVG_TIMER_WAIT'):
+            return [{'AVG_TIMER_WAIT': i * 10 ** 9, 'SUM_TIMER_WAIT': i * 10 ** 11} for i in range(1, 200)]
+        if upper.startswith('SELECT ('):
+            return [dict(self.glob)]
+        if upper.startswith('SELECT VERSION()'):
+            return [{'version': self.version, 'performance_schema': 1, 'sys_schema': 1,
+                     'plugins': 'group_replication'}]
+        if 'SETUP_CONSUMERS' in upper:
+            return [{'NAME': name} for name in ('global_instrumentation', 'thread_instrumentation',
+                                                'statements_digest')]
+        if 'SETUP_INSTRUMENTS' in upper:
+            return [{'enabled': 500}]
+        if 'GLOBAL_STATUS' in upper:
+            return [{'VARIABLE_VALUE': row['Value']} for row in self.status_rows
+                    if row['Variable_name'] == 'Threads_running']
+        return [{}]
+
+
+class FakeCursor:
+    def __init__(self, server):
+        self._server = server
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        self._rows = self._server.answer(sql)
+
+    def fetchall(self):
+        return self._rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, server):
+        self._server = server
+        self.connection_id = 1
+
+    def cursor(self, dictionary=False, **kwargs):
+        return FakeCursor(self._server)
+
+    def is_connected(self):
+        return True
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeIndices:
+    def __init__(self):
+        self.created = set()
+
+    def exists(self, index):
+        return index in self.created
+
+    def create(self, index, settings=None, body=None, **kwargs):
+        self.created.add(index)
+
+    def put_index_template(self, **kwargs):
+        pass
+
+
+class FakeElasticsearch:
+    """Counts what would have been shipped."""
+
+    def __init__(self):
+        self.indices = FakeIndices()
+        self.requests = 0
+        self.docs = 0
+        self.bytes = 0
+
+    def bulk(self, operations, **kwargs):
+        self.requests += 1
+        self.docs += operations.count(b"\n" if isinstance(operations, (bytes, bytearray)) else "\n") // 2
+        self.bytes += len(operations)
+        return {'errors': False, 'items': []}
+
+    def info(self):
+        return {'version': {'number': 'fake'}}
+
+    def close(self):
+        pass
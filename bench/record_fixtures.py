@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Record bench/fixtures from a live server
+
+  python bench/record_fixtures.py -h 10.0.20.204 -u admin -P secret
+"""
+
+import argparse
+import decimal
+import getpass
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysql.connector as Database
+
+import mysqlstatus
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def get_args_parser():
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("-h", "--host", default="localhost", type=str)
+    parser.add_argument("-p", "--port", default=3306, type=int)
+    parser.add_argument("-u", "--user", default=getpass.getuser(), type=str)
+    parser.add_argument("-P", "--password", default='', type=str)
+    parser.add_argument("--help", default=False, action='store_true')
+    return parser
+
+
+def dump(name, data):
+    def default(value):
+        if isinstance(value, decimal.Decimal):
+            return float(value)
+        return str(value)
+    with open(os.path.join(FIXTURES, name), 'w') as fp:
+        json.dump(data, fp, indent=1, default=default)
+
+
+if __name__ == '__main__':
+    parser = get_args_parser()
+    options = parser.parse_args()
+    if options.help:
+        parser.print_help()
+        parser.exit()
+
+    db = Database.connect(host=options.host, user=options.user, port=options.port,
+                          passwd=options.password, connection_timeout=10)
+    qthread = mysqlstatus.QueryThread(db=db, dbhost=options.host)
+    dump('show_global_status.json', qthread.query("SHOW GLOBAL STATUS"))
+    dump('show_variables.json', qthread.query("SHOW VARIABLES"))
+    dump('processlist.json', qthread.query(
+        "SELECT ID, HOST, DB, COMMAND, TIME, STATE, INFO FROM INFORMATION_SCHEMA.PROCESSLIST ORDER BY TIME DESC"))
+    glob = dict(qthread.get_global())
+    glob.pop('Collect time(ms)', None)
+    dump('global.json', glob)
+    qthread.cleanup_mysql()
@@ -4,5 +4,8 @@
 #python3.9 mysqlstatus.py -h 10.0.20.204 -u admin -P'Welcome#1' --debug -m global -o -n
 #python3.9 mysqlstatus.py -h 10.0.20.204 -u admin -P'Welcome#1' --debug -n -o test.log
 
+# Fleet (several servers from one process)
+#python3.9 mysqlstatus.py --inventory inventory.yml --workers 16 -m global -n -e elk.yml
+
 # No Debug
 python3.9 mysqlstatus.py -h 10.0.20.204 -u admin -P'Welcome#1' -m global
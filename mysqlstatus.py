@@ -5,20 +5,64 @@ This is monitoring tool for MySQL
 """
 
 import argparse
-import curses
+import bisect
+import collections.abc
+import concurrent.futures
+import csv
+import fnmatch
+import functools
 import getpass
+import gzip
+import heapq
+import importlib
+import importlib.util
+import locale
 import logging
+import mmap
+import numbers
 import os
+import random
+import re
+import select
+import shutil
 import sys
 import threading
 import time
-import yaml
 import json
+from array import array
 from datetime import datetime
-from pytz import timezone
-from elasticsearch import Elasticsearch
 
-import mysql.connector as Database
+
+class LazyModule:
+    """Module imported on first attribute access.
+
+    The client libraries cost most of the startup time and every mode needs
+    only some of them; a cron run writing to stdout never loads the
+    Elasticsearch client. python bench/bench_startup.py measures it.
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    @property
+    def available(self):
+        return self._module is not None or importlib.util.find_spec(self._name) is not None
+
+
+curses = LazyModule('curses')
+yaml = LazyModule('yaml')
+pytz = LazyModule('pytz')
+elasticsearch = LazyModule('elasticsearch')
+http_server = LazyModule('http.server')
+zstandard = LazyModule('zstandard')
+orjson = LazyModule('orjson')
+Database = LazyModule('mysql.connector')
 
 __title__ = 'mysqlstatus'
 __version__ = '1.0.0-DEV'
@@ -53,18 +97,103 @@ def get_args_parser():
     parser.add_argument("-i", "--interval",
         default=1,
         nargs='?',
+        type=float,
+        help="Interval second of monitoring(0.5 for twice a second).")
+    parser.add_argument("--max-interval",
+        default=60,
+        nargs='?',
+        type=float,
+        help="Longest interval the monitoring backs off to while the server is busy.")
+    parser.add_argument("--backoff-collect",
+        default=0.5,
+        nargs='?',
+        type=float,
+        help="Back off while a collection takes more than this part of the interval(0: off).")
+    parser.add_argument("--backoff-threads",
+        default=0,
+        nargs='?',
+        type=int,
+        help="Back off while Threads_running is over N(0: off).")
+    parser.add_argument("--query-timeout",
+        default=10,
+        nargs='?',
+        type=int,
+        help="Seconds a monitoring query may run(MAX_EXECUTION_TIME) before it is aborted.")
+    parser.add_argument("--count",
+        default=0,
+        nargs='?',
+        type=int,
+        help="Exit after N samples of every server(0: run forever). avairable for non-interactive, not with --exporter.")
+    parser.add_argument("--history",
+        default=300,
+        nargs='?',
         type=int,
-        help="Interval second of monitoring.")
+        help="Seconds of history behind the sparklines and min/avg/p95 of the interactive screens.")
     parser.add_argument("-o", "--outfile",
         default=sys.stdout,
         nargs='?',
         type=argparse.FileType('w'),
         help="Output result file. avairable for non-interactive.")
+    parser.add_argument("--format",
+        default='dict',
+        nargs='?',
+        choices=['dict', 'ndjson', 'csv'],
+        help="Record format of the output: python dict, one JSON object per line or CSV. avairable for non-interactive.")
+    parser.add_argument("--flush-every",
+        default=0,
+        nargs='?',
+        type=int,
+        help="Flush the ndjson/csv output every N samples(0: off).")
+    parser.add_argument("--flush-interval",
+        default=5,
+        nargs='?',
+        type=float,
+        help="Flush the ndjson/csv output every N seconds(0: off).")
+    parser.add_argument("--rotate-size",
+        default=0,
+        nargs='?',
+        type=int,
+        help="Rotate the ndjson/csv outfile when it reaches N bytes(0: off).")
+    parser.add_argument("--rotate-interval",
+        default=0,
+        nargs='?',
+        type=int,
+        help="Rotate the ndjson/csv outfile every N seconds(0: off).")
+    parser.add_argument("--compress",
+        default=None,
+        nargs='?',
+        choices=['gzip', 'zstd'],
+        help="Compress the rotated outfile segments(zstd needs the zstandard package).")
     parser.add_argument("-e", "--elk",
         default=None,
         nargs='?',
         type=argparse.FileType('r'),
         help="Elk Conn info file(only mode:status,global). avairable for non-interactive.")
+    parser.add_argument("--inventory",
+        default=None,
+        nargs='?',
+        type=argparse.FileType('r'),
+        help="Host inventory file(yaml) to monitor several servers from one process. avairable for non-interactive.")
+    parser.add_argument("--workers",
+        default=8,
+        nargs='?',
+        type=int,
+        help="Number of collector workers for --inventory.")
+    parser.add_argument("--collect",
+        default='sys',
+        nargs='?',
+        choices=['sys', 'pfs'],
+        help="Read the global info from the sys views or straight from performance_schema(lower overhead).")
+    parser.add_argument("--values",
+        default='both',
+        nargs='?',
+        choices=['raw', 'rate', 'both'],
+        help="Status values to output: raw counters, per second rates or both(mode:status).")
+    parser.add_argument("--exporter",
+        default=None,
+        nargs='?',
+        type=str,
+        help="Serve the samples in OpenMetrics format on [HOST:]PORT/metrics(mode:status,global). avairable for non-interactive.")
     parser.add_argument("-n", "--nonint",
         default=False,
         action='store_true',
@@ -72,8 +201,13 @@ def get_args_parser():
     parser.add_argument("-m", "--mode",
         default='status',
         nargs='?',
-        choices=['status', 'process', 'global'],
+        choices=['status', 'process', 'global', 'top'],
         help="monitoring Mode")
+    parser.add_argument("--top",
+        default=10,
+        nargs='?',
+        type=int,
+        help="Number of heaviest statement digests per ranking(mode:top).")
     parser.add_argument("--debug",
         default=False,
         action='store_true',
@@ -85,25 +219,846 @@ def get_args_parser():
     return parser
 
 
+# field name, refresh period(sec), scalar subquery
+# a field is collected again only when its period has passed, in between the
+# last value is kept. period 0 means every interval.
+GLOBAL_METRICS = (
+    ('Memory size(GB)', 10, "select total_allocated from sys.memory_global_total"),
+    ('Session num(ea)', 0, "select count(1) from performance_schema.processlist"),
+    ('Lock num(ea)', 0, "select count(1) from sys.innodb_lock_waits"),
+    ('Transaction(ea)', 0, "select count(1) from information_schema.innodb_trx"),
+    ('Tmp size(MB)', 10, "SELECT convert(round(sum(size)/1024/1024,2), FLOAT) FROM INFORMATION_SCHEMA.INNODB_SESSION_TEMP_TABLESPACES where state = 'ACTIVE'"),
+    ('Table Full scan(ea)', 30, "select count(1) from sys.statements_with_full_table_scans"),
+    ('Database size(GB)', 600, "select convert(round(SUM(data_length+index_length)/1024/1024/1024,2),FLOAT) FROM information_schema.tables"),
+    ('ErrorLog(1hour,ea)', 30, "select count(1) from performance_schema.error_log where logged > now() - interval 1 hour and PRIO = 'Error'"),
+    # the x$ view has total_latency in picoseconds, the plain one formatted text
+    ('Slow query(>1s,ea)', 30, "SELECT count(1) FROM sys.x$statements_with_runtimes_in_95th_percentile where total_latency >= 1e12"),
+    ('GroupHA(ea)', 10, "select count(1) from performance_schema.replication_group_members where member_state = 'ONLINE'"),
+    # same count as SHOW REPLICAS, but usable as a subquery
+    ('Replication(ea)', 10, "select count(1) from performance_schema.processlist where command in ('Binlog Dump', 'Binlog Dump GTID')"),
+)
+
+# --collect pfs: GLOBAL_METRICS fields read straight from performance_schema
+# instead of the sys views, which format, sort and join only to be counted.
+# None is aggregated in python by QueryThread.pfs_slow_queries.
+PFS_METRICS = {
+    'Memory size(GB)': "select sum(CURRENT_NUMBER_OF_BYTES_USED) from performance_schema.memory_summary_global_by_event_name",
+    'Lock num(ea)': "select count(1) from performance_schema.data_lock_waits where ENGINE = 'INNODB'",
+    'Table Full scan(ea)': "select count(1) from performance_schema.events_statements_summary_by_digest where (SUM_NO_INDEX_USED > 0 or SUM_NO_GOOD_INDEX_USED > 0) and DIGEST_TEXT not like 'SHOW%'",
+    'Slow query(>1s,ea)': None,
+}
+
+
+# what a GLOBAL_METRICS field needs from the server, checked against the
+# capabilities QueryThread.probe() reads once per connection: a version,
+# 'sys', 'memory' (memory instruments), a P_S consumer or an active plugin.
+# Fields the server cannot answer are left out of the query plan.
+GLOBAL_REQUIREMENTS = {
+    'Memory size(GB)': ('sys', 'memory'),
+    'Lock num(ea)': ('sys',),
+    'Tmp size(MB)': ('8.0.13',),
+    'Table Full scan(ea)': ('sys', 'statements_digest'),
+    'ErrorLog(1hour,ea)': ('8.0.22',),
+    'Slow query(>1s,ea)': ('sys', 'statements_digest'),
+    'GroupHA(ea)': ('group_replication',),
+}
+
+# MySQL errors telling the server cannot answer a query at all (no such table,
+# column, function or view, or no privilege), any other error may pass
+CAPABILITY_ERRORS = frozenset((1044, 1049, 1054, 1142, 1143, 1146, 1227, 1305, 1356, 1370))
+
+# same for the --collect pfs queries
+PFS_REQUIREMENTS = {
+    'Memory size(GB)': ('memory',),
+    'Lock num(ea)': ('8.0.1',),
+    'Table Full scan(ea)': ('statements_digest',),
+    'Slow query(>1s,ea)': ('statements_digest',),
+}
+
+
+class ServerCapabilities:
+    """What a server can answer, read once per connection."""
+
+    PLUGINS = ('group_replication',)
+
+    def __init__(self, version='', performance_schema=False, sys_schema=False,
+                 consumers=(), plugins=(), memory=False):
+        self.version_text = version or ''
+        self.mariadb = 'mariadb' in self.version_text.lower()
+        self.version = self.parse_version(self.version_text)
+        self.performance_schema = bool(performance_schema)
+        self.sys_schema = bool(sys_schema)
+        self.consumers = frozenset(consumers)
+        self.plugins = frozenset(plugins)
+        self.memory = bool(memory)
+
+    @staticmethod
+    def parse_version(text):
+        match = re.match(r'^(\d+)\.(\d+)\.(\d+)', text or '')
+        return tuple(int(n) for n in match.groups()) if match else (0, 0, 0)
+
+    def supports(self, requirement):
+        if re.match(r'^\d+\.\d+\.\d+$', requirement):
+            # MariaDB numbers its versions on its own
+            return not self.mariadb and self.version >= self.parse_version(requirement)
+        if requirement == 'sys':
+            return self.sys_schema
+        if requirement == 'memory':
+            return self.performance_schema and self.memory and 'global_instrumentation' in self.consumers
+        if requirement in self.PLUGINS:
+            return requirement in self.plugins
+        return self.performance_schema and requirement in self.consumers
+
+    def missing(self, requirements):
+        return [r for r in requirements if not self.supports(r)]
+
+    @property
+    def process_table(self):
+        if self.performance_schema and self.supports('8.0.22'):
+            return 'performance_schema.processlist'
+        return 'INFORMATION_SCHEMA.PROCESSLIST'
+
+    def __repr__(self):
+        return "%s, performance_schema %s, sys %s, consumers %s, plugins %s, memory %s" % (
+            self.version_text, self.performance_schema, self.sys_schema,
+            ",".join(sorted(self.consumers)), ",".join(sorted(self.plugins)), self.memory)
+
+
+def parse_bytes(text):
+    """ bytes of a sys.format_bytes() string, None if it is not one """
+    match = re.match(r'^\s*(-?[0-9.]+)\s*(bytes|KiB|MiB|GiB|TiB)\s*$', str(text))
+    if match is None:
+        return None
+    power = ('bytes', 'KiB', 'MiB', 'GiB', 'TiB').index(match.group(2))
+    return float(match.group(1)) * 1024 ** power
+
+
+def format_bytes(value):
+    """ same output as sys.format_bytes() """
+    value = float(value or 0)
+    for unit in ('bytes', 'KiB', 'MiB', 'GiB', 'TiB'):
+        if abs(value) < 1024 or unit == 'TiB':
+            break
+        value /= 1024
+    if unit == 'bytes':
+        return "%d %s" % (value, unit)
+    return "%.2f %s" % (value, unit)
+
+
+# SHOW GLOBAL STATUS values that are ever increasing counters, anything else is a level
+STATUS_COUNTERS = frozenset((
+    "Connections",
+    "Flush_commands",
+    "Innodb_buffer_pool_pages_flushed",
+    "Innodb_buffer_pool_wait_free",
+    "Innodb_buffer_pool_write_requests",
+    "Innodb_log_waits",
+    "Innodb_log_write_requests",
+    "Innodb_log_writes",
+    "Innodb_os_log_fsyncs",
+    "Innodb_os_log_written",
+    "Innodb_row_lock_time",
+    "Innodb_row_lock_waits",
+    "Innodb_truncated_status_writes",
+    "Key_read_requests",
+    "Key_reads",
+    "Key_write_requests",
+    "Key_writes",
+    "Qcache_hits",
+    "Qcache_inserts",
+    "Qcache_lowmem_prunes",
+    "Qcache_not_cached",
+    "Queries",
+    "Questions",
+    "Slow_launch_threads",
+    "Slow_queries",
+    "Threads_created",
+))
+STATUS_COUNTER_PREFIXES = (
+    "Aborted_",
+    "Binlog_cache_",
+    "Binlog_stmt_cache_",
+    "Bytes_",
+    "Com_",
+    "Connection_errors_",
+    "Created_tmp_",
+    "Handler_",
+    "Innodb_buffer_pool_read",
+    "Innodb_data_",
+    "Innodb_dblwr_",
+    "Innodb_pages_",
+    "Innodb_rows_",
+    "Max_execution_time_",
+    "Opened_",
+    "Performance_schema_",
+    "Select_",
+    "Sort_",
+    "Table_locks_",
+    "Table_open_cache_",
+)
+
+# levels that the counter prefixes above would match
+STATUS_GAUGES = frozenset((
+    "Buffer_hit",    # derived by QueryThread
+    "QPS",           # derived by QueryThread
+    "Innodb_buffer_pool_load_status",
+    "Innodb_buffer_pool_dump_status",
+    "Innodb_page_size",
+    "Innodb_row_lock_current_waits",
+    "Innodb_row_lock_time_avg",
+    "Innodb_row_lock_time_max",
+    "Innodb_undo_tablespaces_active",
+    "Innodb_undo_tablespaces_explicit",
+    "Innodb_undo_tablespaces_implicit",
+    "Innodb_undo_tablespaces_total",
+    "Performance_schema_session_connect_attrs_longest_seen",
+    "Max_used_connections",
+    "Max_used_connections_time",
+    "Prepared_stmt_count",
+    "Replica_open_temp_tables",
+    "Slave_open_temp_tables",
+    "Slave_running",
+    "Threads_cached",
+    "Threads_connected",
+    "Threads_running",
+    "Uptime",
+    "Uptime_since_flush_status",
+))
+STATUS_GAUGE_PREFIXES = (
+    "Current_tls_",
+    "Innodb_buffer_pool_bytes_",
+    "Innodb_buffer_pool_pages_",
+    "Innodb_data_pending_",
+    "Innodb_os_log_pending_",
+    "Open_",
+    "Rpl_semi_sync_",
+    "Ssl_",
+)
+
+
+def is_status_counter(name):
+    if name in STATUS_COUNTERS:
+        return True
+    return name.startswith(STATUS_COUNTER_PREFIXES) \
+        and name not in STATUS_GAUGES and not name.startswith(STATUS_GAUGE_PREFIXES)
+
+
+class StatusSlots:
+    """Variable name -> array slot, assigned once per name and shared by
+    every StatusSnapshot of a server."""
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.counter = bytearray()
+
+    def slot(self, name):
+        i = self.index.get(name)
+        if i is None:
+            i = len(self.names)
+            self.index[name] = i
+            self.names.append(name)
+            self.counter.append(is_status_counter(name))
+        return i
+
+
+class StatusSnapshot(collections.abc.Mapping):
+    """SHOW GLOBAL STATUS parsed straight into a reusable array of doubles.
+
+    Loading a new sample overwrites the same array; a slot belongs to the
+    current sample when its seen mark equals the snapshot generation. The few
+    values that are not numbers (ON/OFF, cipher names ...) go to a small dict.
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.values = array('d')
+        self.seen = array('L')
+        self.generation = 0
+        self.text = {}
+        self.time = None
+
+    def _grow(self):
+        missing = len(self.slots.names) - len(self.values)
+        if missing > 0:
+            self.values.extend([0.0] * missing)
+            self.seen.extend([0] * missing)
+
+    def clear(self):
+        self.generation += 1
+        self.text.clear()
+        self._grow()
+
+    def load(self, rows, now=None):
+        self.clear()
+        self.time = time.monotonic() if now is None else now
+        index = self.slots.index
+        values, seen, generation = self.values, self.seen, self.generation
+        for row in rows:
+            name = row['Variable_name']
+            value = row['Value']
+            try:
+                number = float(value)
+            except (TypeError, ValueError):
+                self.text[name] = value
+                continue
+            i = index.get(name)
+            if i is None:
+                i = self.slots.slot(name)
+                self._grow()
+            values[i] = number
+            seen[i] = generation
+        return self
+
+    def set(self, name, number):
+        i = self.slots.slot(name)
+        self._grow()
+        self.values[i] = number
+        self.seen[i] = self.generation
+
+    def number(self, name, default=None):
+        i = self.slots.index.get(name)
+        if i is None or i >= len(self.seen) or self.seen[i] != self.generation:
+            return default
+        return self.values[i]
+
+    def __getitem__(self, name):
+        if name in self.text:
+            return self.text[name]
+        value = self.number(name)
+        if value is None:
+            raise KeyError(name)
+        return int(value) if value.is_integer() else value
+
+    def __iter__(self):
+        seen, generation = self.seen, self.generation
+        for i, name in enumerate(self.slots.names[:len(seen)]):
+            if seen[i] == generation:
+                yield name
+        for name in self.text:
+            yield name
+
+    def __len__(self):
+        return self.seen.count(self.generation) + len(self.text)
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+    def copy(self):
+        snapshot = StatusSnapshot(self.slots)
+        snapshot.values = self.values[:]
+        snapshot.seen = self.seen[:]
+        snapshot.generation = self.generation
+        snapshot.text = dict(self.text)
+        snapshot.time = self.time
+        return snapshot
+
+
+class SnapshotRing:
+    """StatusSnapshots handed to the samples without copying.
+
+    A snapshot is loaded again only once nothing but the ring refers to it,
+    that is every sample holding it was consumed; when all of them are still
+    held one more is allocated. A collector whose samples are consumed in
+    time cycles through three or four snapshots.
+    """
+    # the ring list, the loop variable and the getrefcount() argument
+    FREE_REFS = 3
+
+    def __init__(self, slots, size=3):
+        self.slots = slots
+        self.snapshots = [StatusSnapshot(slots) for _ in range(size)]
+
+    def take(self):
+        for snapshot in self.snapshots:
+            if sys.getrefcount(snapshot) <= self.FREE_REFS:
+                return snapshot
+        snapshot = StatusSnapshot(self.slots)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+
+class CounterRates:
+    """Per second rates of the SHOW GLOBAL STATUS counters between two samples.
+
+    A server restart (Uptime going down) or FLUSH STATUS (Uptime_since_flush_status
+    going down) starts over from the new sample. A counter that goes down
+    from close to 2^32 or 2^64 has wrapped around, one that goes down from
+    anywhere else was reset and has no rate in this sample. The rates are
+    written to the given StatusSnapshot, one reused snapshot by default.
+    """
+    WRAPS = (2 ** 32, 2 ** 64)
+    # a wrapped counter was at least this fraction of its limit
+    NEAR_WRAP = 0.9
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.rates = StatusSnapshot(slots)
+
+    def update(self, current, previous, rates=None):
+        if rates is None:
+            rates = self.rates
+        rates.clear()
+        rates.time = current.time
+        if previous is None or previous.time is None:
+            return rates
+
+        for name in ('Uptime', 'Uptime_since_flush_status'):
+            now, last = current.number(name), previous.number(name)
+            if None not in (now, last) and now < last:
+                logging.debug("status counters were reset, skip one rate sample")
+                return rates
+
+        elapsed = current.time - previous.time
+        if elapsed <= 0:
+            return rates
+
+        counter = self.slots.counter
+        cur, cur_seen, cur_gen = current.values, current.seen, current.generation
+        prev, prev_seen, prev_gen = previous.values, previous.seen, previous.generation
+        values, seen, generation = rates.values, rates.seen, rates.generation
+        for i in range(min(len(cur), len(prev), len(values))):
+            if counter[i] and cur_seen[i] == cur_gen and prev_seen[i] == prev_gen:
+                delta = cur[i] - prev[i]
+                if delta < 0:
+                    wrap = self.wrap(prev[i])
+                    if wrap is None:
+                        continue
+                    delta += wrap
+                values[i] = round(delta / elapsed, 2)
+                seen[i] = generation
+        return rates
+
+    def wrap(self, last):
+        """ the limit a counter last at `last` wrapped around, None if it was reset """
+        for wrap in self.WRAPS:
+            if wrap * self.NEAR_WRAP <= last <= wrap:
+                return wrap
+        return None
+
+
+class DigestSampler:
+    """Top-N statement digests of the last interval.
+
+    Works on the deltas of performance_schema.events_statements_summary_by_digest
+    between two ticks and ranks them by latency, rows examined and executions
+    with bounded heaps. Only digests seen since the previous tick are fetched;
+    the cumulative values of at most `track` digests and the text of at most
+    `texts` digests are remembered, least recently seen first out.
+    """
+    RANKINGS = (
+        ('latency', 'SUM_TIMER_WAIT'),
+        ('rows_examined', 'SUM_ROWS_EXAMINED'),
+        ('executions', 'COUNT_STAR'),
+    )
+
+    def __init__(self, top=10, track=10000, texts=1000):
+        self.top = top
+        self.track = track
+        self.texts = texts
+        self._texts = collections.OrderedDict()
+        self.reset()
+
+    def reset(self):
+        self._last = collections.OrderedDict()
+        self._last_seen = None
+        self._last_time = None
+
+    @property
+    def last_seen(self):
+        return self._last_seen
+
+    def update(self, rows, now=None):
+        """ rows since last_seen -> [top digests], ranked by latency """
+        if now is None:
+            now = time.monotonic()
+        first = self._last_seen is None
+        elapsed = now - self._last_time if self._last_time is not None else 0
+        self._last_time = now
+
+        deltas = []
+        last = self._last
+        for row in rows:
+            key = (row['SCHEMA_NAME'], row['DIGEST'])
+            current = (row['COUNT_STAR'], row['SUM_TIMER_WAIT'], row['SUM_ROWS_EXAMINED'])
+            previous = last.pop(key, None)
+            last[key] = current
+            if self._last_seen is None or row['LAST_SEEN'] > self._last_seen:
+                self._last_seen = row['LAST_SEEN']
+            if first:
+                continue
+            if previous is None or current[0] < previous[0]:
+                # new digest, or the summary table was truncated
+                previous = (0, 0, 0)
+            if current[0] == previous[0]:
+                continue
+            deltas.append({
+                'COUNT_STAR': current[0] - previous[0],
+                'SUM_TIMER_WAIT': current[1] - previous[1],
+                'SUM_ROWS_EXAMINED': current[2] - previous[2],
+                'key': key,
+            })
+        while len(last) > self.track:
+            last.popitem(last=False)
+
+        ranked = collections.OrderedDict()
+        for name, column in self.RANKINGS:
+            for delta in heapq.nlargest(self.top, deltas, key=lambda d: d[column]):
+                ranked.setdefault(delta['key'], (delta, []))[1].append(name)
+
+        top = []
+        for (schema, digest), (delta, rankings) in ranked.items():
+            top.append({
+                'schema': schema,
+                'digest': digest,
+                'digest_text': self._texts.get(digest),
+                'exec_count': delta['COUNT_STAR'],
+                'latency(ms)': round(delta['SUM_TIMER_WAIT'] / 1e9, 3),
+                'avg_latency(ms)': round(delta['SUM_TIMER_WAIT'] / 1e9 / delta['COUNT_STAR'], 3),
+                'rows_examined': delta['SUM_ROWS_EXAMINED'],
+                'interval(s)': round(elapsed, 2),
+                'top_by': rankings,
+            })
+        top.sort(key=lambda row: row['latency(ms)'], reverse=True)
+        return top
+
+    def missing_texts(self, top):
+        return [row['digest'] for row in top if row['digest_text'] is None]
+
+    def add_texts(self, top, texts):
+        for digest, text in texts.items():
+            self._texts[digest] = text
+            self._texts.move_to_end(digest)
+        while len(self._texts) > self.texts:
+            self._texts.popitem(last=False)
+        for row in top:
+            if row['digest_text'] is None:
+                row['digest_text'] = self._texts.get(row['digest'])
+
+
+# data is None when the server could not be read, health tells why
+Sample = collections.namedtuple('Sample', ('dbhost', 'variables', 'mode', 'data', 'rates', 'health'),
+                                defaults=(None,))
+
+
+class SampleQueue:
+    """Bounded handoff of Samples from the collectors to the output mode.
+
+    Consumers block in get() until a sample arrives. When they fall behind,
+    the oldest sample is dropped so the newest one is always delivered.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._samples = collections.deque()
+        self._cond = threading.Condition()
+        self._pipe = None
+
+    def watch(self):
+        """fd that becomes readable when a sample is put, for select()."""
+        if self._pipe is None:
+            self._pipe = os.pipe()
+            for fd in self._pipe:
+                os.set_blocking(fd, False)
+        return self._pipe[0]
+
+    def drain_watch(self):
+        try:
+            while os.read(self._pipe[0], 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def put(self, sample):
+        with self._cond:
+            if len(self._samples) >= self.maxsize:
+                self._samples.popleft()
+                self.dropped += 1
+                logging.warning("output is behind, dropped the oldest sample (%d in total)", self.dropped)
+            self._samples.append(sample)
+            self._cond.notify()
+        if self._pipe is not None:
+            try:
+                os.write(self._pipe[1], b'\0')
+            except BlockingIOError:
+                # the pipe is full, the reader is already due to wake up
+                pass
+
+    def get(self, timeout=None):
+        """Oldest sample, or None after timeout seconds without one."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._samples, timeout):
+                return None
+            return self._samples.popleft()
+
+    def drain(self):
+        """Every queued sample, oldest first, without waiting."""
+        with self._cond:
+            samples = list(self._samples)
+            self._samples.clear()
+            return samples
+
+    def get_latest(self, timeout=None):
+        """Newest sample, skipping the older ones (for screens)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._samples, timeout):
+                return None
+            sample = self._samples.pop()
+            self._samples.clear()
+            return sample
+
+
+class QueryFailure(tuple):
+    """The () ManagedConnection.query() returns for a failed statement, with
+    the MySQL error number when there is one."""
+
+    def __new__(cls, errno=None):
+        failure = tuple.__new__(cls)
+        failure.errno = errno
+        return failure
+
+
+class ManagedConnection:
+    """MySQL connection of one server that reconnects by itself.
+
+    query() never raises and never blocks on a dead connection: a lost
+    connection is closed, marked down, and opened again on a later call,
+    waiting RETRY_WAIT seconds after the first failure and twice as long
+    after every further one, up to MAX_RETRY_WAIT. Every new session gets
+    MAX_EXECUTION_TIME so a slow probe is aborted by the server; SHOW
+    statements are bounded by the socket timeout of the connection.
+    `health` is what the sinks report about the server.
+    """
+    RETRY_WAIT = 1
+    MAX_RETRY_WAIT = 60
+
+    def __init__(self, connect=None, db=None, query_timeout=None, name=None):
+        # connect() returns a new DB-API connection, without it db.reconnect() is used
+        self._connect = connect
+        self._db = db
+        self._cursor = None
+        self.query_timeout = query_timeout
+        self.name = name
+        self.lock = threading.Lock()
+        self._retry_at = 0
+        self._retry_wait = self.RETRY_WAIT
+        # sessions opened so far, a new one may be another server version
+        self.sessions = 0
+        self.health = {'up': False, 'error': None, 'down_since': None,
+                       'reconnects': 0, 'failures': 0}
+        if db is not None:
+            self._setup()
+
+    @property
+    def up(self):
+        return self.health['up']
+
+    def _setup(self):
+        self._cursor = self._db.cursor(dictionary=True)
+        if self.query_timeout:
+            try:
+                self._cursor.execute("SET SESSION MAX_EXECUTION_TIME = %d" % (self.query_timeout * 1000))
+            except Database.Error as err:
+                # MySQL < 5.7.8 and MariaDB
+                logging.debug("%s: no MAX_EXECUTION_TIME: %s", self.name, err)
+        self.health.update({'up': True, 'error': None, 'down_since': None})
+        self._retry_wait = self.RETRY_WAIT
+        self.sessions += 1
+
+    def open(self):
+        """ True when the connection is usable, reconnects once it is due """
+        with self.lock:
+            return self._open()
+
+    def _open(self):
+        if self.health['up']:
+            return True
+        if time.monotonic() < self._retry_at:
+            return False
+        first = self._db is None and self.health['down_since'] is None
+        try:
+            if self._connect is not None:
+                self._db = self._connect()
+            else:
+                self._db.reconnect()
+            self._setup()
+        except Exception as err:
+            self.down(err)
+            return False
+        if not first:
+            self.health['reconnects'] += 1
+            logging.warning("%s: reconnected", self.name)
+        return True
+
+    def down(self, err):
+        if self.health['up'] or self.health['down_since'] is None:
+            logging.warning("%s: connection lost: %s", self.name, err)
+            self.health['down_since'] = time.time()
+        self.health.update({'up': False, 'error': str(err)})
+        self._retry_at = time.monotonic() + self._retry_wait
+        self._retry_wait = min(self._retry_wait * 2, self.MAX_RETRY_WAIT)
+        self._close()
+
+    def query(self, sql, params=None):
+        """ rows of sql, an empty QueryFailure when it failed or the server is down """
+        with self.lock:
+            if not self._open():
+                return QueryFailure()
+            try:
+                self._cursor.execute(sql, params)
+                return self._cursor.fetchall()
+            except Database.InterfaceError as err:
+                self.down(err)
+                return QueryFailure(getattr(err, 'errno', None))
+            except Exception as err:
+                logging.exception(err)
+                self.health['failures'] += 1
+                # a timeout or a server error, or the connection went away with it
+                if not self._db.is_connected():
+                    self.down(err)
+                return QueryFailure(getattr(err, 'errno', None))
+
+    def _close(self):
+        for handle in (self._cursor, self._db):
+            try:
+                if handle is not None:
+                    handle.close()
+            except Exception as err:
+                logging.debug("%s: close: %s", self.name, err)
+        self._cursor = None
+
+    def close(self):
+        with self.lock:
+            self.health['up'] = False
+            self._close()
+
+
+class ConnectionPool:
+    """One ManagedConnection per server(host, port, user).
+
+    Collectors of the same server share its connection and a reconnect is
+    done once for all of them.
+    """
+
+    def __init__(self, connect, query_timeout=None):
+        self._connect = connect
+        self.query_timeout = query_timeout
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get(self, host, port, user, password, name=None):
+        key = (host, port, user)
+        with self._lock:
+            conn = self._connections.get(key)
+            if conn is None:
+                conn = self._connections[key] = ManagedConnection(
+                    connect=lambda: self._connect(host, port, user, password),
+                    query_timeout=self.query_timeout,
+                    name=name or "%s:%d" % (host, port))
+            return conn
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+
+
+class PollSchedule:
+    """Fixed collection cadence on monotonic deadlines that backs off under load.
+
+    The next deadline is the previous one plus the interval, so the time
+    the queries take does not add up; deadlines already missed are skipped,
+    not caught up. While a collection takes more than collect_ratio of the
+    interval, or Threads_running is over threads_running, the interval is
+    doubled up to max_interval; it comes back by halves once both are below.
+    """
+    MIN_INTERVAL = 0.05
+
+    def __init__(self, interval, max_interval=None, collect_ratio=0.5, threads_running=0, name=None):
+        self.base = max(float(interval), self.MIN_INTERVAL)
+        self.max_interval = max(float(max_interval or self.base), self.base)
+        self.collect_ratio = collect_ratio
+        self.threads_running = threads_running
+        self.name = name
+        self.interval = self.base
+        self.deadline = time.monotonic()
+
+    def due(self, now=None):
+        return (time.monotonic() if now is None else now) >= self.deadline
+
+    def sleep_time(self, now=None):
+        return max(self.deadline - (time.monotonic() if now is None else now), 0)
+
+    def done(self, started, finished, threads_running=None):
+        """ a collection ran from started to finished, plan the next one """
+        took = finished - started
+        busy = (self.collect_ratio and took > self.interval * self.collect_ratio) \
+            or (self.threads_running and threads_running is not None
+                and threads_running > self.threads_running)
+        interval = self.interval
+        if busy:
+            interval = min(interval * 2, self.max_interval)
+        elif interval > self.base and not (self.collect_ratio and took > interval / 2 * self.collect_ratio):
+            # only when the shorter interval would not be too busy again
+            interval = max(interval / 2, self.base)
+        if interval != self.interval:
+            logging.warning("%s: interval %.2fs -> %.2fs (collect %.3fs, Threads_running %s)",
+                            self.name, self.interval, interval, took, threads_running)
+            self.interval = interval
+
+        if started < self.deadline:
+            # woken up early(mode change), the cadence restarts from here
+            self.deadline = started
+        self.deadline += self.interval
+        if self.deadline <= finished:
+            missed = int((finished - self.deadline) // self.interval) + 1
+            self.deadline += missed * self.interval
+
+
 class QueryThread(threading.Thread):
     _stop = False
-    _update = False
     _mysql_variables = None
     _mysql_status = None
     _mysql_procesesslist = None
-    _mysql_global = {}
+    _mysql_global = None
 
     def __init__(self, **kwargs):
 
         self.mysql_last_status = None
-
-        self._db = kwargs.get('db')
-        self._cursor = self._db.cursor(dictionary=True)
-        self._interval = kwargs.get('interval', 1)
+        self._mysql_rates = {}
+        slots = StatusSlots()
+        self._status_ring = SnapshotRing(slots)
+        self._rates_ring = SnapshotRing(slots)
+        self._rates = CounterRates(slots)
+        self._mysql_global = {}
+        self._global_refreshed = {}
+        self._process_index = {}
+        self._process_fetched = set()
+        self._process_time = None
+        self._digests = DigestSampler(top=kwargs.get('top', 10))
+        self._mysql_top = None
+        self._process_table = 'performance_schema.processlist'
+        self._capabilities = None
+        self._probed_session = None
+        self._global_plan = None
+        # rows of the processlist that need INFO, None is all of them
+        self.visible_rows = None
+
+        self.dbhost = kwargs.get('dbhost')
+        self._conn = kwargs.get('conn')
+        if self._conn is None:
+            self._conn = ManagedConnection(db=kwargs.get('db'), name=self.dbhost)
+        self._samples = kwargs.get('samples')
+        self._collect = kwargs.get('collect', 'sys')
+        self._schedule = PollSchedule(kwargs.get('interval', 1),
+                                      max_interval=kwargs.get('max_interval'),
+                                      collect_ratio=kwargs.get('backoff_collect', 0.5),
+                                      threads_running=kwargs.get('backoff_threads', 0),
+                                      name=self.dbhost)
+        self._wakeup = threading.Event()
         self._mode = 'status'
 
-        self.lock = threading.Lock()
-
         threading.Thread.__init__(self, name="QueryThread")
         self.setDaemon(True)
 
@@ -112,25 +1067,28 @@ class QueryThread(threading.Thread):
         """SHOW VARIABLES"""
         if self._mysql_variables is None:
             result = self.query("SHOW VARIABLES")
+            if not result:
+                # asked again once the server is back
+                return {}
             self._mysql_variables = self.to_dict(result)
             logging.debug(self._mysql_variables)
         return self._mysql_variables
 
+    @property
+    def health(self):
+        return self._conn.health
+
     @property
     def mysql_status(self):
         return self._mysql_status
 
     @property
-    def mode(self):
-        return self._mode
+    def mysql_rates(self):
+        return self._mysql_rates
 
     @property
-    def update(self):
-        return self._update
-
-    @update.setter
-    def update(self, value):
-        self._update = value
+    def mode(self):
+        return self._mode
 
     @mode.setter
     def mode(self, value):
@@ -138,8 +1096,15 @@ class QueryThread(threading.Thread):
             self._mode = 'process'
         elif value == 'status':
             self._mode = 'status'
+        elif value == 'top':
+            if self._mode != 'top':
+                # deltas over the time spent in another mode are useless
+                self._digests.reset()
+            self._mode = 'top'
         else:
             self._mode = 'global'
+        # collect the new mode now, not at the next deadline
+        self._wakeup.set()
 
     @property
     def stop(self):
@@ -148,6 +1113,7 @@ class QueryThread(threading.Thread):
     @stop.setter
     def stop(self, value):
         self._stop = value
+        self._wakeup.set()
 
     @property
     def mysql_procesesslist(self):
@@ -157,127 +1123,335 @@ class QueryThread(threading.Thread):
     def mysql_global(self):
         return self._mysql_global
 
+    @property
+    def mysql_top(self):
+        return self._mysql_top
+
+    @property
+    def schedule(self):
+        return self._schedule
+
     def run(self):
+        self._wakeup.clear()
         while self._stop == False:
-            if self._mode == 'process':
-                self.get_procesesslist()
-            elif self._mode == 'status':
-                self.get_status()
-            else:
-                self.get_global()
-            time.sleep(self._interval)
+            self.poll()
+            # a mode change or stop wakes it up early
+            self._wakeup.wait(self._schedule.sleep_time())
+            self._wakeup.clear()
         self.cleanup_mysql()
 
-    def cleanup_mysql(self):
-        self._cursor.close()
-        self._db.close()
-
-    def query(self, sql):
-        result = ()
+    def poll(self):
+        """ collect() once and plan the next one """
+        started = finished = time.monotonic()
+        threads_running = None
         try:
-            self.lock.acquire()
-            self._cursor.execute(sql)
-            result = self._cursor.fetchall()
-            self.lock.release()
+            self.collect()
+            finished = time.monotonic()
+            threads_running = self.threads_running()
         except Exception as err:
+            # a bad sample must not end the monitoring
             logging.exception(err)
-        return result
+            finished = time.monotonic()
+        self._schedule.done(started, finished, threads_running)
+
+    def threads_running(self):
+        """ Threads_running for the back-off, None when it is not watched """
+        if not self._schedule.threads_running or not self._conn.up:
+            return None
+        if self._mode == 'status' and self._mysql_status is not None:
+            value = self._mysql_status.get('Threads_running')
+        else:
+            result = self.query("SELECT VARIABLE_VALUE FROM performance_schema.global_status"
+                                " WHERE VARIABLE_NAME = 'Threads_running'")
+            value = result[0]['VARIABLE_VALUE'] if result else None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+    def collect(self):
+        mode = self._mode
+        rates = None
+        if not self._conn.open():
+            if self._samples is not None:
+                self._samples.put(Sample(self.dbhost, self._mysql_variables or {}, mode, None, None,
+                                         dict(self._conn.health)))
+            return
+        if self._probed_session != self._conn.sessions:
+            self.probe()
+        if mode == 'process':
+            data = self.get_procesesslist()
+        elif mode == 'status':
+            # the snapshots are not reused while the sample holds them
+            data = self.get_status()
+            if data is not None:
+                rates = self._mysql_rates
+        elif mode == 'top':
+            data = self.get_top_digests()
+        else:
+            data = dict(self.get_global())
+        if not self._conn.up:
+            # lost while collecting, the data is partial
+            data, rates = None, None
+        if self._samples is not None:
+            self._samples.put(Sample(self.dbhost, self.mysql_variables, mode, data, rates,
+                                     dict(self._conn.health)))
+
+    def cleanup_mysql(self):
+        self._conn.close()
+
+    def query(self, sql, params=None):
+        return self._conn.query(sql, params)
 
     def get_status(self):
-        """ SHOW GLOBAL STATUS """
-        if self._mysql_status is not None:
-            self.mysql_last_status = self._mysql_status
+        """ SHOW GLOBAL STATUS, None when it failed """
         result = self.query("SHOW GLOBAL STATUS")
-        self._mysql_status = self.to_dict(result)
+        if isinstance(result, QueryFailure):
+            # no sample this tick, the last good one stays the base of the rates
+            return None
+        # a snapshot no sample holds anymore is overwritten in place
+        previous = self._mysql_status
+        current = self._status_ring.take()
+        self._mysql_status = current.load(result)
+        self.mysql_last_status = previous
+        self._mysql_rates = self._rates.update(current, previous, self._rates_ring.take())
         #logging.debug(self._mysql_status)
         self.get_query_per_second()
-        self._update = True
         return self._mysql_status
 
     def get_procesesslist(self):
-        """SHOW PROCESSLIST"""
-        result = self.query("SELECT ID, HOST, DB, TIME, STATE, INFO FROM INFORMATION_SCHEMA.PROCESSLIST ORDER BY TIME DESC")
-        if result is not None:
-            self._mysql_procesesslist = result
-            self._update = True
-
-        logging.debug(result)
+        """
+        SHOW PROCESSLIST without INFO, diffed against the previous snapshot by ID.
+        INFO is only fetched for visible rows that are new or run a new statement.
+        A statement is the same as before only when it started before the
+        previous snapshot, its TIME is over the time since then; a session
+        running a new short statement every tick looks the same otherwise.
+        None when the processlist could not be read.
+        """
+        now = time.monotonic()
+        sql = "SELECT ID, HOST, DB, COMMAND, TIME, STATE FROM %s" % self._process_table
+        result = self.query(sql)
+        if isinstance(result, QueryFailure) and result.errno in CAPABILITY_ERRORS \
+           and self._process_table != 'INFORMATION_SCHEMA.PROCESSLIST':
+            # performance_schema.processlist needs 8.0.22+ and the privilege on it
+            logging.warning("%s: %s cannot be read, using INFORMATION_SCHEMA.PROCESSLIST",
+                            self.dbhost, self._process_table)
+            self._process_table = 'INFORMATION_SCHEMA.PROCESSLIST'
+            result = self.query("SELECT ID, HOST, DB, COMMAND, TIME, STATE FROM %s" % self._process_table)
+        if isinstance(result, QueryFailure):
+            # no data this tick, the previous snapshot stays the base of the diff
+            return None
+        elapsed = None if self._process_time is None else now - self._process_time
+        self._process_time = now
+
+        previous, fetched = self._process_index, self._process_fetched
+        index = {}
+        for row in result:
+            last = previous.get(row['ID'])
+            if last is not None and elapsed is not None and (row['TIME'] or 0) > elapsed \
+               and last['STATE'] == row['STATE'] and last['COMMAND'] == row['COMMAND']:
+                # same statement as before, keep its text
+                row['INFO'] = last['INFO']
+            else:
+                row['INFO'] = None
+                fetched.discard(row['ID'])
+            index[row['ID']] = row
+        self._process_index = index
+        self._process_fetched = fetched = fetched & index.keys()
+
+        process = sorted(result, key=lambda row: row['TIME'] or 0, reverse=True)
+        visible = process if self.visible_rows is None else process[:self.visible_rows]
+        missing = [row for row in visible if row['ID'] not in fetched]
+        if missing:
+            infos = self.query("SELECT ID, INFO FROM %s WHERE ID IN (%s)" % (
+                self._process_table, ", ".join(str(int(row['ID'])) for row in missing)))
+            if not isinstance(infos, QueryFailure):
+                infos = dict((info['ID'], info['INFO']) for info in infos)
+                for row in missing:
+                    row['INFO'] = infos.get(row['ID'])
+                    fetched.add(row['ID'])
+
+        self._mysql_procesesslist = process
+        logging.debug("%d sessions, %d INFO fetched", len(process), len(missing))
         return self._mysql_procesesslist
 
-    def get_global(self):
-        """ """
-
-        def add_dict(result):
-            if result is not None:
-                self._mysql_global.update(result[0])
-
-        result = self.query("select total_allocated as 'Memory size(GB)' from sys.memory_global_total")
-        add_dict(result)
-
-        result = self.query("select count(1) as 'Session num(ea)' from performance_schema.processlist")
-        add_dict(result)
-
-        result = self.query("select count(1) as 'Lock num(ea)' from sys.innodb_lock_waits")
-        add_dict(result)
-
-        result = self.query("select count(1) as 'Transaction(ea)' from information_schema.innodb_trx")
-        add_dict(result)
-
-        result = self.query("SELECT convert(round(sum(size)/1024/1024,2), FLOAT) as 'Tmp size(MB)' FROM INFORMATION_SCHEMA.INNODB_SESSION_TEMP_TABLESPACES where state = 'ACTIVE'")
-        add_dict(result)
-
-        result = self.query("select count(1) as 'Table Full scan(ea)' from sys.statements_with_full_table_scans")
-        add_dict(result)
-
-        result = self.query("select convert(round(SUM(data_length+index_length)/1024/1024/1024,2),FLOAT) as 'Database size(GB)' FROM information_schema.tables")
-        add_dict(result)
-
-        result = self.query("select count(1) as 'ErrorLog(1hour,ea)' from performance_schema.error_log where logged > now() - interval 1 hour and PRIO = 'Error'")
-        add_dict(result)
+    def get_top_digests(self):
+        """ Top-N statement digests of the last interval """
+        if self._capabilities is not None and not self._capabilities.supports('statements_digest'):
+            if self._mysql_top is None:
+                logging.warning("%s: top needs the statements_digest consumer", self.dbhost)
+            self._mysql_top = []
+            return self._mysql_top
+        sql = "SELECT SCHEMA_NAME, DIGEST, COUNT_STAR, SUM_TIMER_WAIT, SUM_ROWS_EXAMINED, LAST_SEEN" \
+              " FROM performance_schema.events_statements_summary_by_digest"
+        if self._digests.last_seen is None:
+            result = self.query(sql)
+        else:
+            result = self.query(sql + " WHERE LAST_SEEN >= %s", (self._digests.last_seen,))
 
-        result = self.query("SELECT count(1) as 'Slow query(>1s,ea)' FROM sys.statements_with_runtimes_in_95th_percentile where total_latency >= 1000000")
-        add_dict(result)
+        top = self._digests.update(result)
+        missing = self._digests.missing_texts(top)
+        if missing:
+            texts = self.query(
+                "SELECT DIGEST, DIGEST_TEXT FROM performance_schema.events_statements_summary_by_digest"
+                " WHERE DIGEST IN (%s)" % ", ".join(["%s"] * len(missing)), tuple(missing))
+            self._digests.add_texts(top, dict((row['DIGEST'], row['DIGEST_TEXT']) for row in texts))
 
-        result = self.query("select count(1) as 'GroupHA(ea)' from performance_schema.replication_group_members where member_state = 'ONLINE'")
-        add_dict(result)
+        self._mysql_top = top
+        logging.debug("%d digests since last tick, %d in top", len(result), len(top))
+        return self._mysql_top
 
-        result = self.query("show replicas")
-        if result is not None:
-            self._mysql_global.update({'Replication(ea)' : "%s" % str(len(result))})
+    def get_global(self):
+        """ One SELECT with a scalar subquery per due GLOBAL_METRICS field """
+        started = time.time()
+        now = time.monotonic()
+
+        due = [(field, subquery) for field, period, subquery in self.global_metrics()
+               if field not in self._global_refreshed
+               or now - self._global_refreshed[field] >= period]
+
+        # fields without a subquery are aggregated in python
+        aggregated = [field for field, subquery in due if subquery is None]
+        due = [(field, subquery) for field, subquery in due if subquery is not None]
+        if not due and not aggregated:
+            return self._mysql_global
+
+        sql = "SELECT " + ", ".join(
+            "(%s) as '%s'" % (subquery, field) for field, subquery in due)
+        result = self.query(sql) if due else ()
+        if result:
+            self._mysql_global.update(result[0])
+            for field, subquery in due:
+                self._global_refreshed[field] = now
         else:
-            self._mysql_global.update({'Replication(ea)' : '0'})
+            # one failing subquery fails the whole row, so fall back to
+            # one query per field to keep the fields that still work
+            for field, subquery in due:
+                if not self._conn.up:
+                    break
+                result = self.query("SELECT (%s) as '%s'" % (subquery, field))
+                if result:
+                    self._mysql_global.update(result[0])
+                    self._global_refreshed[field] = now
+                elif self._conn.up and getattr(result, 'errno', None) in CAPABILITY_ERRORS:
+                    self.unplan(field)
+                elif self._conn.up:
+                    # a timeout or a transient error, try again next period
+                    logging.warning("%s: '%s' failed, retried next period", self.dbhost, field)
+                    self._global_refreshed[field] = now
+
+        for field in aggregated:
+            slow = self.pfs_slow_queries()
+            if slow is not None:
+                self._mysql_global.update({field: slow})
+                self._global_refreshed[field] = now
+
+        if self._collect == 'pfs':
+            memory = self._mysql_global.get('Memory size(GB)')
+            if memory is not None and not isinstance(memory, str):
+                self._mysql_global['Memory size(GB)'] = format_bytes(memory)
+
+        self._mysql_global.update({'Collect time(ms)': round((time.time() - started) * 1000, 2)})
 
         logging.debug(self._mysql_global)
-        self._update = True
 
         return self._mysql_global
 
+    @property
+    def capabilities(self):
+        return self._capabilities
+
+    def probe(self):
+        """ read the capabilities of the server and plan the queries once per connection """
+        self._probed_session = self._conn.sessions
+        result = self.query(
+            "SELECT VERSION() as version, @@performance_schema as performance_schema,"
+            " (SELECT count(1) FROM information_schema.SCHEMATA WHERE SCHEMA_NAME = 'sys') as sys_schema,"
+            " (SELECT GROUP_CONCAT(PLUGIN_NAME) FROM information_schema.PLUGINS"
+            "   WHERE PLUGIN_STATUS = 'ACTIVE' AND PLUGIN_NAME IN (%s)) as plugins"
+            % ", ".join("'%s'" % plugin for plugin in ServerCapabilities.PLUGINS))
+        if not result:
+            # planned again on the next connection
+            self._probed_session = None
+            return
+        row = result[0]
+        consumers, memory = (), False
+        if row.get('performance_schema'):
+            consumers = [r['NAME'] for r in self.query(
+                "SELECT NAME FROM performance_schema.setup_consumers WHERE ENABLED = 'YES'")]
+            instruments = self.query(
+                "SELECT count(1) as enabled FROM performance_schema.setup_instruments"
+                " WHERE NAME LIKE 'memory/%' AND ENABLED = 'YES'")
+            memory = bool(instruments and instruments[0]['enabled'])
+        self._capabilities = ServerCapabilities(
+            version=row.get('version'),
+            performance_schema=row.get('performance_schema'),
+            sys_schema=row.get('sys_schema'),
+            consumers=consumers,
+            plugins=[plugin for plugin in (row.get('plugins') or '').split(',') if plugin],
+            memory=memory)
+        logging.info("%s: %r", self.dbhost, self._capabilities)
+
+        self._process_table = self._capabilities.process_table
+        self._global_plan = None
+
+    def global_metrics(self):
+        """ the GLOBAL_METRICS the server can answer, planned once per probe """
+        if self._global_plan is None:
+            plan = []
+            for field, period, subquery in GLOBAL_METRICS:
+                requirements = GLOBAL_REQUIREMENTS.get(field, ())
+                if self._collect == 'pfs' and field in PFS_METRICS:
+                    subquery = PFS_METRICS[field]
+                    requirements = PFS_REQUIREMENTS.get(field, ())
+                if self._capabilities is not None:
+                    missing = self._capabilities.missing(requirements)
+                    if missing:
+                        logging.info("%s: '%s' skipped, needs %s", self.dbhost, field, ", ".join(missing))
+                        continue
+                if subquery is not None:
+                    subquery = subquery.replace('performance_schema.processlist', self._process_table)
+                plan.append((field, period, subquery))
+            self._global_plan = plan
+        return self._global_plan
+
+    def unplan(self, field):
+        """ drop a field the server cannot answer, until the next connection """
+        logging.warning("%s: '%s' cannot be answered, not collected until reconnected", self.dbhost, field)
+        self._global_plan = [metric for metric in self.global_metrics() if metric[0] != field]
+        self._mysql_global.pop(field, None)
+
+    def pfs_slow_queries(self):
+        """
+        sys.statements_with_runtimes_in_95th_percentile without the view:
+        digests whose average latency is in the top 5%, with >= 1s in total
+        """
+        result = self.query("SELECT AVG_TIMER_WAIT, SUM_TIMER_WAIT FROM performance_schema.events_statements_summary_by_digest")
+        if not result:
+            return None
+        averages = sorted(row['AVG_TIMER_WAIT'] for row in result)
+        threshold = averages[max(0, int(len(averages) * 0.95 + 0.5) - 1)]
+        # timer columns are picoseconds
+        return sum(1 for row in result
+                   if row['AVG_TIMER_WAIT'] >= threshold and row['SUM_TIMER_WAIT'] >= 10 ** 12)
+
     def get_query_per_second(self):
         if self._mysql_status is None:
             return 0.0
-        if self.mysql_last_status is not None:
-            [current, last] = map(lambda x: float(x),
-                (self._mysql_status.get('Uptime'),
-                 self.mysql_last_status.get('Uptime')))
-            elapsed_time = last - current
-
-            [current, last] = map(lambda x: float(x),
-                (self._mysql_status.get('Questions', 0),
-                self.mysql_last_status.get('Questions', 0)))
-            inc_query = last - current
-        else:
-            [elapsed_time, inc_query] = map(lambda x: float(x),
-                (self._mysql_status.get('Uptime', 0),
-                self._mysql_status.get('Questions', 0)))
+        status = self._mysql_status
         try:
-            qps = inc_query / elapsed_time
-            buffhit = ((float(self._mysql_status.get('Innodb_buffer_pool_read_requests')) / (float(self._mysql_status.get('Innodb_buffer_pool_read_requests')) + float(self._mysql_status.get('Innodb_buffer_pool_reads')))) * 100)
-        except:
+            qps = self._mysql_rates.number('Questions')
+            if qps is None:
+                # first sample or just restarted, average since startup
+                qps = status.number('Questions', 0) / status.number('Uptime', 0)
+            read_requests = status.number('Innodb_buffer_pool_read_requests')
+            buffhit = read_requests / (read_requests + status.number('Innodb_buffer_pool_reads')) * 100
+        except (TypeError, ZeroDivisionError):
             qps = 0.0
             buffhit = 0.0
 
-        self._mysql_status.update({'QPS': "%0.2f" % qps})
-        self._mysql_status.update({'Buffer_hit': "%.2f" % float(buffhit)})
+        status.set('QPS', round(qps, 2))
+        status.set('Buffer_hit', round(buffhit, 2))
 
         return qps, buffhit
 
@@ -288,6 +1462,80 @@ class QueryThread(threading.Thread):
                 dictset))
 
 
+class FleetThread(threading.Thread):
+    """Poll several servers from one thread with a bounded worker pool.
+
+    Each target is a QueryThread that is never started; the pool calls its
+    poll() whenever its own schedule is due and its previous poll is done.
+    The scheduler never waits for a poll, so a busy or unreachable server
+    backs off without slowing down the others.
+    """
+    _stop = False
+
+    def __init__(self, **kwargs):
+        self._collectors = kwargs.get('collectors')
+        self._interval = kwargs.get('interval', 1)
+        self._workers = kwargs.get('workers', 8)
+        self._mode = 'status'
+        self._polling = {}
+        self._wakeup = threading.Event()
+
+        threading.Thread.__init__(self, name="FleetThread")
+        self.setDaemon(True)
+
+    @property
+    def collectors(self):
+        return self._collectors
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, value):
+        for collector in self._collectors:
+            collector.mode = value
+        self._mode = self._collectors[0].mode if self._collectors else value
+
+    @property
+    def stop(self):
+        return self._stop
+
+    @stop.setter
+    def stop(self, value):
+        self._stop = value
+        self._wakeup.set()
+
+    def reap(self):
+        """ forget the finished polls, so their collectors can be scheduled again """
+        for collector, future in list(self._polling.items()):
+            if not future.done():
+                continue
+            del self._polling[collector]
+            err = future.exception()
+            if err is not None:
+                logging.error("%s: %s", collector.dbhost, err)
+
+    def run(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self._workers,
+                                                   thread_name_prefix="Collector") as pool:
+            while self._stop == False:
+                self._wakeup.clear()
+                self.reap()
+                now = time.monotonic()
+                for collector in self._collectors:
+                    if collector not in self._polling and collector.schedule.due(now):
+                        future = pool.submit(collector.poll)
+                        self._polling[collector] = future
+                        future.add_done_callback(lambda _: self._wakeup.set())
+                # a poll finishing early wakes the loop up to schedule its collector
+                now = time.monotonic()
+                idle = [c.schedule.sleep_time(now) for c in self._collectors if c not in self._polling]
+                self._wakeup.wait(min(idle or [self._interval]))
+        for collector in self._collectors:
+            collector.cleanup_mysql()
+
+
 class MySQLStatus:
     keywords = (
         "Buffer_hit",    
@@ -338,30 +1586,217 @@ class MySQLStatus:
 
     def __init__(self, options):
         self.options = options
+        self.samples = SampleQueue()
+        self.pool = ConnectionPool(self.connect, query_timeout=getattr(options, 'query_timeout', None))
+
+        if getattr(options, 'inventory', None) is not None:
+            self.qthread = FleetThread(
+                collectors=self.load_inventory(options.inventory),
+                interval=options.interval,
+                workers=options.workers,
+            )
+            # a fleet puts one sample per server per tick, room for two ticks
+            self.samples.maxsize = max(self.samples.maxsize, 2 * len(self.qthread.collectors))
+        else:
+            conn = self.pool.get(self.options.host, self.options.port,
+                                 self.options.user, self.options.password,
+                                 name=self.options.host)
+            if not conn.open():
+                # a wrong host or password is better told right away
+                print(conn.health['error'])
+                sys.exit()
+
+            self.qthread = QueryThread(
+                conn=conn,
+                dbhost=self.options.host,
+                interval=options.interval,
+                max_interval=options.max_interval,
+                backoff_collect=options.backoff_collect,
+                backoff_threads=options.backoff_threads,
+                samples=self.samples,
+                collect=options.collect,
+                top=options.top,
+            )
+        self.qthread.mode = options.mode
+        self.servers = set(c.dbhost for c in getattr(self.qthread, 'collectors', None) or (self.qthread,))
+        # samples output per server, and servers still short of --count
+        self.output_count = {}
+        self.output_pending = len(self.servers)
+        self.qthread.start()
 
-        try:
-            db = Database.connect(
-                host=self.options.host,
-                user=self.options.user,
-                port=self.options.port,
-                passwd=self.options.password,
-                connection_timeout=10)
-        except Exception as err:
-            logging.exception(err)
-            print(err)
+    def over_count(self, sample):
+        """ --count: the server of sample already had its count samples output """
+        count = getattr(self.options, 'count', 0)
+        return bool(count) and self.output_count.get(sample.dbhost, 0) >= count
+
+    def counted(self, sample):
+        """ --count: True once count samples of every server were output """
+        count = getattr(self.options, 'count', 0)
+        if not count:
+            return False
+        self.output_count[sample.dbhost] = self.output_count.get(sample.dbhost, 0) + 1
+        if self.output_count[sample.dbhost] == count and sample.dbhost in self.servers:
+            self.output_pending -= 1
+        return self.output_pending <= 0
+
+    def status_values(self, status, rates, names=None):
+        """ raw counters and/or their per second rates(<name>_per_sec) by --values """
+        if names is None:
+            names = status.keys()
+        values = {}
+        for k in names:
+            if self.options.values != 'rate' or k not in rates:
+                values[k] = status.get(k)
+            if self.options.values != 'raw' and k in rates:
+                values[k + '_per_sec'] = rates[k]
+        return values
+
+    def connect(self, host, port, user, password):
+        # also the socket timeout of every query with the pure python connector
+        timeout = max(10, (getattr(self.options, 'query_timeout', None) or 0) + 5)
+        return Database.connect(
+            host=host,
+            user=user,
+            port=port,
+            passwd=password,
+            connection_timeout=timeout)
+
+    def load_inventory(self, fp):
+        """
+        hosts:
+          - host: 10.0.20.204
+            port: 3306          # default: --port
+            user: admin         # default: --user
+            password: secret    # default: --password
+        """
+        inventory = yaml.load(fp, Loader=yaml.FullLoader) or {}
+        collectors = []
+        for target in inventory.get('hosts', []):
+            if not isinstance(target, dict):
+                target = {'host': target}
+            host = target.get('host')
+            port = int(target.get('port', self.options.port))
+            name = target.get('name', "%s:%d" % (host, port))
+            conn = self.pool.get(host, port,
+                                 target.get('user', self.options.user),
+                                 str(target.get('password', self.options.password)),
+                                 name=name)
+            if not conn.open():
+                # kept, it is reported down and retried
+                print("%s is down, retrying in background: %s" % (name, conn.health['error']))
+            collectors.append(QueryThread(
+                conn=conn,
+                dbhost=name,
+                interval=self.options.interval,
+                max_interval=self.options.max_interval,
+                backoff_collect=self.options.backoff_collect,
+                backoff_threads=self.options.backoff_threads,
+                samples=self.samples,
+                collect=self.options.collect,
+                top=self.options.top,
+            ))
+        if not collectors:
+            print("no host in inventory")
             sys.exit()
+        return collectors
+
+
+class MetricHistory:
+    """Last `size` values of one metric in a ring buffer of doubles.
+
+    min/max come from monotonic deques, avg from a running sum and p95 from a
+    sorted copy kept with bisect, so reading them does not walk the window.
+    """
+    SPARK = u' \u2581\u2582\u2583\u2584\u2585\u2586\u2587\u2588'
+    SPARK_ASCII = ' _.-=^'
+
+    def __init__(self, size):
+        self.size = max(size, 1)
+        self.values = array('d', [0.0] * self.size)
+        self.count = 0
+        self._pos = 0
+        self._seq = 0
+        self._total = 0.0
+        self._sorted = []
+        self._min = collections.deque()
+        self._max = collections.deque()
+
+    def add(self, value):
+        if self.count == self.size:
+            old = self.values[self._pos]
+            self._total -= old
+            del self._sorted[bisect.bisect_left(self._sorted, old)]
+        else:
+            self.count += 1
+        self.values[self._pos] = value
+        self._pos = (self._pos + 1) % self.size
+        self._total += value
+        bisect.insort(self._sorted, value)
+
+        seq = self._seq
+        self._seq += 1
+        for window, better in ((self._min, lambda a, b: a <= b), (self._max, lambda a, b: a >= b)):
+            while window and better(value, window[-1][1]):
+                window.pop()
+            window.append((seq, value))
+            if window[0][0] <= seq - self.size:
+                window.popleft()
 
-        self.qthread = QueryThread(
-            db=db,
-            interval=options.interval,
-        )
-        self.qthread.mode = options.mode
-        self.qthread.start()
+    @property
+    def min(self):
+        return self._min[0][1] if self.count else None
+
+    @property
+    def max(self):
+        return self._max[0][1] if self.count else None
+
+    @property
+    def avg(self):
+        return self._total / self.count if self.count else None
+
+    @property
+    def p95(self):
+        if not self.count:
+            return None
+        return self._sorted[max(0, -(-self.count * 95 // 100) - 1)]
+
+    def last(self, n):
+        """ up to n newest values, oldest first """
+        n = min(n, self.count)
+        return [self.values[(self._pos - n + i) % self.size] for i in range(n)]
+
+    def sparkline(self, width, ascii_only=False):
+        chars = self.SPARK_ASCII if ascii_only else self.SPARK
+        low, high = self.min, self.max
+        if low is None:
+            return ' ' * width
+        span = (high - low) or 1.0
+        top = len(chars) - 1
+        line = ''.join(chars[1 + int((value - low) / span * (top - 1) + 0.5)] for value in self.last(width))
+        return line.rjust(width)
+
+
+def short_number(value):
+    if value is None:
+        return '-'
+    for unit in ('', 'k', 'M', 'G', 'T'):
+        if abs(value) < 1000 or unit == 'T':
+            break
+        value /= 1000.0
+    return ("%d%s" if value == int(value) else "%.1f%s") % (value, unit)
 
 
 class IntractiveMode(MySQLStatus):
+    SPARK_WIDTH = 20
+    # the global screen lines
+    GLOBAL_FIELDS = [field for field, period, subquery in GLOBAL_METRICS] + ['Collect time(ms)']
+
     def run(self):
         logging.debug('starting IntractiveMode')
+        locale.setlocale(locale.LC_ALL, '')
+        self.ascii_only = locale.getpreferredencoding(False).lower().replace('-', '') != 'utf8'
+        self.history = {}
+        self.history_size = max(int(self.options.history / self.options.interval), 1)
         self.window = curses.initscr()
         #curses.start_color()
         self.window.nodelay(1)
@@ -383,99 +1818,213 @@ class IntractiveMode(MySQLStatus):
             self.cleanup()
 
     def mainloop(self):
+        self.sample = None
+        self._lines_mode = None
+        stdin = sys.stdin.fileno()
+        notify = self.samples.watch()
         while True:
-            c = self.window.getch()
-            if c == ord('q'):
-                break
-            elif c == ord('p'):
-                self.qthread.mode = 'process'
-            elif c == ord('s'):
-                self.qthread.mode = 'status'
-            elif c == ord('g'):
-                self.qthread.mode = 'global'
-            elif c == ord('h') or c == ord('?'):
-                self.show_help()
-            elif c == curses.KEY_RESIZE:
-                self.set_window_size()
-            if self.qthread.update == True:
+            # sleeps until a key is pressed or the collector has a sample
+            readable, _, _ = select.select([stdin, notify], [], [], 1)
+            if notify in readable:
+                self.samples.drain_watch()
+            while True:
+                c = self.window.getch()
+                if c == -1:
+                    break
+                if c == ord('q'):
+                    return
+                self.handle_key(c)
+            samples = self.samples.drain()
+            for sample in samples:
+                self.add_history(sample)
+            if samples:
+                self.sample = samples[-1]
+                self.show_update()
+
+    def add_history(self, sample):
+        """ per metric history of the fields on the status(rates of counters) and global screens """
+        if sample.data is None:
+            return
+        if sample.mode == 'status':
+            data, rates = sample.data, sample.rates
+            values = [(k, rates.get(k) if is_status_counter(k) else data.get(k)) for k in self.keywords]
+        elif sample.mode == 'global':
+            values = [(k, sample.data.get(k)) for k in self.GLOBAL_FIELDS]
+        else:
+            return
+        for key, value in values:
+            if isinstance(value, (int, float)):
+                history = self.history.get((sample.mode, key))
+                if history is None:
+                    history = self.history[(sample.mode, key)] = MetricHistory(self.history_size)
+                history.add(value)
+
+    def history_text(self, mode, key):
+        history = self.history.get((mode, key))
+        if history is None:
+            return ''
+        return " %s %7s/%7s/%7s" % (
+            history.sparkline(self.SPARK_WIDTH, self.ascii_only),
+            short_number(history.min), short_number(history.avg), short_number(history.p95))
+
+    def handle_key(self, c):
+        if c == ord('p'):
+            self.qthread.mode = 'process'
+        elif c == ord('s'):
+            self.qthread.mode = 'status'
+        elif c == ord('g'):
+            self.qthread.mode = 'global'
+        elif c == ord('t'):
+            self.qthread.mode = 'top'
+        elif c == ord('h') or c == ord('?'):
+            self.show_help()
+            if self.sample is not None:
                 self.show_update()
-            time.sleep(0.1)
+        elif c == curses.KEY_RESIZE:
+            self.set_window_size()
 
     def set_window_size(self):
         (self.window_max_y, self.window_max_x) = self.window.getmaxyx()
+        # header(3) + column names + border
+        self.qthread.visible_rows = max(self.window_max_y - 5, 0)
+        self._lines = None
+
+    def draw_line(self, y, text, attr=0):
+        """ rewrite line y only when it differs from the last drawn frame """
+        text = text[0:self.window_max_x - 2].ljust(self.window_max_x - 2)
+        self._frame.add(y)
+        if self._lines.get(y) == (text, attr):
+            return
+        self._lines[y] = (text, attr)
+        self.window.addstr(y, 1, text, attr)
 
     def show_header(self):
-        variables = self.qthread.mysql_variables
+        variables = self.sample.variables
         data = {
             'hostname': variables.get('hostname'),
-            'currenttime': datetime.now(timezone('Asia/Seoul')).strftime("%Y-%m-%d %H:%M:%S"),
+            'currenttime': datetime.now(pytz.timezone('Asia/Seoul')).strftime("%Y-%m-%d %H:%M:%S"),
             'mysql_version': variables.get('version'),
-            'innodb_buffer': int(variables.get('innodb_buffer_pool_size'))/1024/1024,
+            'innodb_buffer': int(variables.get('innodb_buffer_pool_size') or 0)/1024/1024,
         }
         data = "%(hostname)s, %(currenttime)s, %(mysql_version)s, %(innodb_buffer)d MB" % data
-        self.window.addstr(1, 1, data)
-        self.window.addstr(2, 1, "-" * 70)
+        self.draw_line(1, data)
+        self.draw_line(2, "-" * 70)
 
     def show_update(self):
-        self.qthread.update = False
-        self.window.erase()
-        self.window.box()
+        """
+        Draws the frame of the current sample over the previous one, only
+        the lines that changed are written. The screen is cleared only when
+        the mode or the window size changed.
+        """
+        if self._lines is None or self.sample.mode != self._lines_mode:
+            self.window.erase()
+            self.window.box()
+            self._lines = {}
+        self._lines_mode = self.sample.mode
+        self._frame = set()
+
         self.show_header()
-        if self.qthread.mode == 'process':
+        if self.sample.data is None:
+            self.show_down()
+        elif self.sample.mode == 'process':
             self.show_update_process()
-        elif self.qthread.mode == 'status':
+        elif self.sample.mode == 'status':
             self.show_update_status()
+        elif self.sample.mode == 'top':
+            self.show_update_top()
         else:
             self.show_update_global()
-            
+
+        # blank the lines the previous frame had and this one has not
+        for y in [y for y in self._lines if y not in self._frame]:
+            self.window.addstr(y, 1, " " * (self.window_max_x - 2))
+            del self._lines[y]
+        self.window.box()
+        self.window.refresh()
+
+    def show_down(self):
+        health = self.sample.health
+        if health['down_since'] is None:
+            # connected, but the collection failed
+            self.draw_line(3, "%s did not answer, %d failed queries" % (self.sample.dbhost, health['failures']),
+                           curses.A_BOLD)
+            self.draw_line(4, '')
+            return
+        since = datetime.fromtimestamp(health['down_since'], pytz.timezone('Asia/Seoul')).strftime("%H:%M:%S")
+        self.draw_line(3, "%s is down since %s, reconnecting" % (self.sample.dbhost, since), curses.A_BOLD)
+        self.draw_line(4, health['error'] or '')
+
+    def truncated(self, y, count):
+        """
+        rows of count items drawn from line y that fit in the box; when they
+        do not all fit, the last line inside the box tells how many were left out
+        """
+        rows = max(self.window_max_y - 1 - y, 0)
+        if count <= rows:
+            return count
+        rows = max(rows - 1, 0)
+        self.draw_line(self.window_max_y - 2, "[%d items were truncated.]" % (count - rows))
+        return rows
 
     def show_update_status(self):
-        status = self.qthread.mysql_status
+        status = self.sample.data
+        rates = self.sample.rates
         y = 3
-        for k in self.keywords:
-            data = "%-35s: %12s" % (k, status.get(k))
-            if y + 1 < self.window_max_y:
-                self.window.addstr(y, 1, data)
+        for k in self.keywords[:self.truncated(y, len(self.keywords))]:
+            if k not in rates or self.options.values == 'raw':
+                data = "%-35s: %12s" % (k, status.get(k))
+            elif self.options.values == 'rate':
+                data = "%-35s: %12s/s" % (k, rates[k])
+            else:
+                data = "%-35s: %12s %12s/s" % (k, status.get(k), rates[k])
+            self.draw_line(y, "%-64s%s" % (data, self.history_text('status', k)))
 
             y = y + 1
-        if len(self.keywords) + 1 > self.window_max_y:
-            omits = len(self.keywords) + 1 - self.window_max_y
-            self.window.addstr(self.window_max_y - 1, 1,
-                "[%d items were truncated.]" % omits)
 
     def show_update_process(self):
         """
         Id, Host, db, User, Time, State, Type(Command), Query(Info)
         """
-        process = self.qthread.mysql_procesesslist
+        process = self.sample.data
         y = 3
         header_format = '%-5s, %-8s, %8s, %7s, %6s, %12s,'
         header_item = ('ID', 'HOST', 'DB', 'TIME', 'STATE', 'INFO')
         header = header_format % header_item
         data_format = '%(ID)-5s, %(HOST)-8s, %(DB)8s, %(TIME)7s, %(STATE)6s, %(INFO)12s,'
-        self.window.addstr(y, 1, header, curses.A_BOLD)
+        self.draw_line(y, header, curses.A_BOLD)
         y = y + 1
-        for item in process:
-            data = data_format % item
-            # TODO truncate if variables to display is too long.
-            if len(data) > self.window_max_x:
-                data = data[0:self.window_max_x-2]
-
-            if y + 1 < self.window_max_y:
-                self.window.addstr(y, 1, data)
-            else: 
-                omits = len(process) + (y - 1) - self.window_max_y
-                self.window.addstr(self.window_max_y - 1, 1, "[%d items were truncated.]" %omits)
+        for item in process[:self.truncated(y, len(process))]:
+            self.draw_line(y, data_format % item)
             y = y + 1
 
     def show_update_global(self):
-        glob = self.qthread.mysql_global
+        glob = self.sample.data
     
         y = 3
 
         for key,val in glob.items():
+            if y + 1 >= self.window_max_y:
+                break
             data = "%-35s: %12s" % (key, val)
-            self.window.addstr(y, 1, data)
+            self.draw_line(y, "%-64s%s" % (data, self.history_text('global', key)))
+            y = y + 1
+
+    def show_update_top(self):
+        """
+        Heaviest statement digests of the last interval
+        """
+        top = self.sample.data
+        y = 3
+        header = '%-8s %10s %10s %12s  %-10s %s' % ('EXEC', 'TOTAL(ms)', 'AVG(ms)', 'ROWS_EXAM', 'SCHEMA', 'DIGEST_TEXT')
+        self.draw_line(y, header, curses.A_BOLD)
+        y = y + 1
+        for item in top:
+            if y + 1 >= self.window_max_y:
+                break
+            data = '%-8s %10.1f %10.3f %12s  %-10s %s' % (
+                item['exec_count'], item['latency(ms)'], item['avg_latency(ms)'],
+                item['rows_examined'], item['schema'], item['digest_text'])
+            self.draw_line(y, data)
             y = y + 1
 
     def cleanup(self):
@@ -493,6 +2042,7 @@ class IntractiveMode(MySQLStatus):
            s : switch to status mode
            p : switch to process mode
            g : switch to server info mode
+           t : switch to top statements mode
            h : show this help message
            ? : alias of help
            q : quit
@@ -505,16 +2055,176 @@ class IntractiveMode(MySQLStatus):
 
         self.window.erase()
         self.window.nodelay(1)
+        self._lines = None
+
+
+def json_default(value):
+    """ Decimal and friends as numbers, everything else(datetime, ...) as text """
+    if isinstance(value, numbers.Number):
+        return float(value)
+    return str(value)
+
+
+def compress_file(path, method):
+    """ path -> path.gz or path.zst, the original is removed once complete """
+    if method == 'zstd':
+        target = path + '.zst'
+        with open(path, 'rb') as src, open(target + '.tmp', 'wb') as out:
+            with zstandard.ZstdCompressor().stream_writer(out) as writer:
+                shutil.copyfileobj(src, writer, 1024 * 1024)
+    else:
+        target = path + '.gz'
+        with open(path, 'rb') as src, gzip.open(target + '.tmp', 'wb') as out:
+            shutil.copyfileobj(src, out, 1024 * 1024)
+    os.rename(target + '.tmp', target)
+    os.remove(path)
+    return target
+
+
+class RecordWriter:
+    """NDJSON or CSV records with a fixed column order.
+
+    Records go through one buffered file and are flushed every `flush_every`
+    samples or `flush_interval` seconds, whichever comes first. A regular
+    file is rotated by size and/or age: the closed segment is renamed to
+    <path>.<YYYYmmdd-HHMMSS> and compressed in the background, and every
+    segment starts with its own CSV header.
+    """
+    BUFFER_SIZE = 1024 * 1024
+
+    def __init__(self, fp, fmt, columns, flush_every=0, flush_interval=5,
+                 rotate_size=0, rotate_interval=0, compress=None):
+        self.fmt = fmt
+        self.columns = columns
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.rotate_size = rotate_size
+        self.rotate_interval = rotate_interval
+        self.compress = compress
+        self.compressing = []
+        self.pending = 0
+        self.flushed = time.monotonic()
+
+        if fp in (sys.stdout, sys.stderr):
+            self.path = None
+            self.open_segment(fp)
+        else:
+            # argparse opened it unbuffered for text, reopen with a big buffer
+            self.path = fp.name
+            fp.close()
+            self.open_segment(open(self.path, 'a', buffering=self.BUFFER_SIZE, newline=''))
+
+    @property
+    def rotating(self):
+        return self.path is not None and bool(self.rotate_size or self.rotate_interval or self.compress)
+
+    def open_segment(self, fp):
+        self.fp = fp
+        self.opened = time.monotonic()
+        self.size = fp.tell() if fp.seekable() else 0
+        if self.fmt == 'csv':
+            self.csv = csv.writer(fp, lineterminator='\n')
+            if self.size == 0:
+                self.csv.writerow(self.columns)
+
+    def write(self, records):
+        """ records of one sample """
+        if self.rotating and (
+                (self.rotate_size and self.size >= self.rotate_size)
+                or (self.rotate_interval and time.monotonic() - self.opened >= self.rotate_interval)):
+            self.rotate()
+
+        columns = self.columns
+        for record in records:
+            if self.fmt == 'csv':
+                row = [record.get(k) for k in columns]
+                self.csv.writerow(row)
+                self.size += sum(len(str(v)) for v in row if v is not None) + len(row)
+            else:
+                line = json.dumps(dict((k, record.get(k)) for k in columns),
+                                  default=json_default, separators=(',', ':'))
+                self.fp.write(line)
+                self.fp.write("\n")
+                self.size += len(line) + 1
+
+        self.pending += 1
+        if self.flush_every and self.pending >= self.flush_every:
+            self.flush()
+        else:
+            self.maybe_flush()
+
+    def maybe_flush(self):
+        if self.pending and self.flush_interval and time.monotonic() - self.flushed >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self.fp.flush()
+        self.pending = 0
+        self.flushed = time.monotonic()
+
+    def rotate(self, reopen=True):
+        self.fp.close()
+        if self.size == 0:
+            os.remove(self.path)
+        else:
+            closed = "%s.%s" % (self.path, datetime.utcnow().strftime('%Y%m%d-%H%M%S'))
+            suffix = 1
+            while os.path.exists(closed) or os.path.exists(closed + '.gz') or os.path.exists(closed + '.zst'):
+                closed = "%s.%s-%d" % (self.path, datetime.utcnow().strftime('%Y%m%d-%H%M%S'), suffix)
+                suffix += 1
+            os.rename(self.path, closed)
+            logging.debug("rotated %s to %s (%d bytes)", self.path, closed, self.size)
+            if self.compress is not None:
+                worker = threading.Thread(target=compress_file, args=(closed, self.compress),
+                                          name="compress", daemon=True)
+                worker.start()
+                self.compressing = [t for t in self.compressing if t.is_alive()] + [worker]
+        if reopen:
+            self.open_segment(open(self.path, 'a', buffering=self.BUFFER_SIZE, newline=''))
+
+    def close(self):
+        if self.fp is None:
+            return
+        if self.rotating:
+            # the last segment is closed like the others
+            self.rotate(reopen=False)
+        elif self.path is not None:
+            self.fp.close()
+        else:
+            self.fp.flush()
+        self.fp = None
+        for worker in self.compressing:
+            worker.join()
 
 
 class CliMode(MySQLStatus):
+    PROCESS_COLUMNS = ('ID', 'HOST', 'DB', 'COMMAND', 'TIME', 'STATE', 'INFO')
+    TOP_COLUMNS = ('rank', 'schema', 'digest', 'exec_count', 'latency(ms)', 'avg_latency(ms)',
+                   'rows_examined', 'interval(s)', 'top_by', 'digest_text')
+
     def run(self):
         logging.debug('starting CliMode')
         self.output = self.options.outfile
         if self.output is None:
             self.output = sys.stdout
+        self.writer = None
 
         try:
+            if self.options.format != 'dict':
+                if self.output in (sys.stdout, sys.stderr) and \
+                   (self.options.rotate_size or self.options.rotate_interval or self.options.compress):
+                    print("--rotate-size, --rotate-interval and --compress need -o/--outfile")
+                    sys.exit()
+                if self.options.compress == 'zstd' and not zstandard.available:
+                    print("--compress zstd needs the zstandard package")
+                    sys.exit()
+                self.writer = RecordWriter(self.output, self.options.format,
+                                           self.columns(self.options.mode),
+                                           flush_every=self.options.flush_every,
+                                           flush_interval=self.options.flush_interval,
+                                           rotate_size=self.options.rotate_size,
+                                           rotate_interval=self.options.rotate_interval,
+                                           compress=self.options.compress)
             self.mainloop()
         except (KeyboardInterrupt, SystemExit) as event:
             logging.exception(event)
@@ -528,36 +2238,739 @@ class CliMode(MySQLStatus):
 
     def mainloop(self):
         while True:
-            if self.qthread.update == True:
-                self.output_action()
-                time.sleep(0.1)
-
-    def output_action(self):
-        self.qthread.update = False
-        if self.qthread.mode == 'process':
-            self.show_update_process()
-        elif self.qthread.mode == 'status':
-            self.show_update_status()
+            sample = self.samples.get(timeout=1)
+            if sample is not None:
+                if not self.over_count(sample):
+                    self.output_action(sample)
+                    if self.counted(sample):
+                        return
+            elif self.writer is not None:
+                self.writer.maybe_flush()
+
+    def columns(self, mode):
+        """ stable column order of --format ndjson/csv """
+        if mode == 'status':
+            columns = []
+            for k in self.keywords:
+                counter = is_status_counter(k)
+                if self.options.values != 'rate' or not counter:
+                    columns.append(k)
+                if self.options.values != 'raw' and counter:
+                    columns.append(k + '_per_sec')
+        elif mode == 'process':
+            columns = list(self.PROCESS_COLUMNS)
+        elif mode == 'top':
+            columns = list(self.TOP_COLUMNS)
         else:
-            self.show_update_global()
+            columns = [field for field, period, subquery in GLOBAL_METRICS] + ['Collect time(ms)']
+        return ['timestamp', 'dbhost', 'dbup'] + columns
+
+    def records(self, sample):
+        """ sample -> records of --format ndjson/csv, one per session or digest for process/top """
+        common = {'timestamp': datetime.utcnow().isoformat(), 'dbhost': sample.dbhost,
+                  'dbup': sample.data is not None}
+        if sample.data is None:
+            rows = [{}]
+        elif sample.mode == 'status':
+            rows = [self.status_values(sample.data, sample.rates, self.keywords)]
+        elif sample.mode == 'process':
+            rows = sample.data
+        elif sample.mode == 'top':
+            rows = []
+            for rank, item in enumerate(sample.data, 1):
+                row = dict(item, rank=rank)
+                if self.options.format == 'csv':
+                    row['top_by'] = '|'.join(item['top_by'])
+                rows.append(row)
+        else:
+            rows = [sample.data]
+        return [dict(row, **common) for row in rows]
+
+    def output_action(self, sample):
+        if self.writer is not None:
+            self.writer.write(self.records(sample))
+            return
+        if self.options.inventory is not None:
+            self.output.write("%s\t" % sample.dbhost)
+        if sample.data is None:
+            self.output.write(str({'dbup': False, 'error': sample.health['error']}))
+        elif sample.mode == 'process':
+            self.show_update_process(sample)
+        elif sample.mode == 'status':
+            self.show_update_status(sample)
+        elif sample.mode == 'top':
+            self.show_update_top(sample)
+        else:
+            self.show_update_global(sample)
         self.output.write("\n")
 
-    def show_update_status(self):
-        status = self.qthread.mysql_status
+    def show_update_status(self, sample):
+        status = self.status_values(sample.data, sample.rates)
         self.output.write(str(status))
 
-    def show_update_process(self):
-        process = self.qthread.mysql_procesesslist
+    def show_update_process(self, sample):
+        process = sample.data
         self.output.write(str(process))
 
-    def show_update_global(self):
-        glob = self.qthread.mysql_global
+    def show_update_global(self, sample):
+        glob = sample.data
         self.output.write(str(glob))
 
+    def show_update_top(self, sample):
+        top = sample.data
+        self.output.write(str(top))
+
     def cleanup(self):
+        if getattr(self, 'writer', None) is not None:
+            try:
+                self.writer.close()
+            except Exception as err:
+                logging.exception(err)
         self.qthread.stop = True
 
+class DiskSpool:
+    """Append-only spool of _bulk bodies kept while Elasticsearch is unavailable.
+
+    Bodies go to numbered segment files of newline delimited JSON, exactly as
+    they would have been sent. When the spool is over max_bytes the oldest
+    segments are evicted. Replay memory-maps the oldest segment and hands it
+    out in chunks of whole documents. How far the oldest segment was shipped
+    is kept in the replay.offset file, a restart resumes from there instead
+    of shipping those documents again.
+    """
+    OFFSET_FILE = 'replay.offset'
+
+    def __init__(self, path, max_bytes=1024 * 1024 * 1024, segment_bytes=64 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        self._offset_file = os.path.join(self.path, self.OFFSET_FILE)
+        # (segment name, offset) shipped so far
+        self._replayed = self.load_offset()
+
+    def load_offset(self):
+        try:
+            with open(self._offset_file) as fp:
+                name, offset = fp.read().split()
+            return (name, int(offset))
+        except FileNotFoundError:
+            return (None, 0)
+        except (OSError, ValueError) as err:
+            logging.warning("ignored %s: %s", self._offset_file, err)
+            return (None, 0)
+
+    def save_offset(self, segment, offset):
+        self._replayed = (os.path.basename(segment), offset)
+        temp = self._offset_file + '.tmp'
+        with open(temp, 'w') as fp:
+            fp.write("%s %d\n" % self._replayed)
+        os.replace(temp, self._offset_file)
+
+    def replay_offset(self, segment):
+        name, offset = self._replayed
+        return offset if name == os.path.basename(segment) else 0
+
+    def remove(self, segment):
+        os.remove(segment)
+        # numbering starts over once the spool is empty, forget the offset with its segment
+        if self._replayed[0] == os.path.basename(segment):
+            self._replayed = (None, 0)
+            os.remove(self._offset_file)
+
+    def segments(self):
+        return sorted(os.path.join(self.path, name) for name in os.listdir(self.path)
+                      if name.startswith('segment-') and name.endswith('.ndjson'))
+
+    def pending(self):
+        return bool(self.segments())
+
+    def append(self, body):
+        segments = self.segments()
+        if segments and os.path.getsize(segments[-1]) < self.segment_bytes:
+            segment = segments[-1]
+        else:
+            number = int(segments[-1][-20:-7]) + 1 if segments else 0
+            segment = os.path.join(self.path, 'segment-%013d.ndjson' % number)
+            segments.append(segment)
+        with open(segment, 'ab') as fp:
+            fp.write(body)
+        self.evict(segments)
+
+    def evict(self, segments):
+        total = sum(os.path.getsize(segment) for segment in segments)
+        while total > self.max_bytes and len(segments) > 1:
+            oldest = segments.pop(0)
+            total -= os.path.getsize(oldest)
+            self.remove(oldest)
+            logging.warning("spool is over %d bytes, evicted %s", self.max_bytes, oldest)
+
+    def next_chunk(self, max_bytes):
+        """(segment, end offset, body) of the next documents to replay, or None"""
+        segments = self.segments()
+        if not segments:
+            return None
+        segment = segments[0]
+        offset = self.replay_offset(segment)
+        with open(segment, 'rb') as fp:
+            size = os.fstat(fp.fileno()).st_size
+            if size <= offset:
+                return (segment, size, b'')
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = end = offset
+                # every document is an action line and a source line
+                while end < size and end - start < max_bytes:
+                    action_end = mm.find(b"\n", end)
+                    source_end = mm.find(b"\n", action_end + 1) if action_end >= 0 else -1
+                    end = size if source_end < 0 else source_end + 1
+                return (segment, end, mm[start:end])
+
+    def commit(self, segment, end):
+        """The chunk up to end was shipped; drop the segment once it is done."""
+        try:
+            size = os.path.getsize(segment)
+        except FileNotFoundError:
+            # evicted while the chunk was in flight
+            logging.warning("%s was evicted during replay, skipped", segment)
+            return
+        if end >= size:
+            self.remove(segment)
+        else:
+            self.save_offset(segment, end)
+
+
+class DocEncoder:
+    """Serialize documents into the lines of a _bulk body.
+
+    orjson is used when it is installed, the json module otherwise. The
+    fields every document of a server carries (dbhost, dbup, dbversion) are
+    encoded once per server by fields() and spliced with the timestamp into
+    the encoded document, instead of being added to every document dict.
+    """
+    MAX_ACTIONS = 64
+
+    def __init__(self):
+        if orjson.available:
+            self._dumps = functools.partial(orjson.dumps, default=json_default)
+        else:
+            encode = json.JSONEncoder(default=json_default, separators=(',', ':')).encode
+            self._dumps = lambda doc: encode(doc).encode('utf-8')
+        self._fields = {}
+        self._actions = {}
+
+    def action(self, index):
+        line = self._actions.get(index)
+        if line is None:
+            # one name per index family and day
+            if len(self._actions) >= self.MAX_ACTIONS:
+                self._actions.clear()
+            line = self._actions[index] = self._dumps({'index': {'_index': index}}) + b"\n"
+        return line
+
+    def fields(self, timestamp=None, **fields):
+        """ fields and timestamp encoded to be spliced into a document, without braces """
+        key = tuple(fields.items())
+        encoded = self._fields.get(key)
+        if encoded is None:
+            encoded = self._fields[key] = self._dumps(fields)[1:-1]
+        if timestamp is not None:
+            stamp = b'"timestamp":"' + timestamp.encode('ascii') + b'"'
+            encoded = encoded + b"," + stamp if encoded else stamp
+        return encoded
+
+    def encode(self, doc, fields=b''):
+        source = self._dumps(doc)
+        if not fields:
+            return source
+        if len(source) == 2:
+            return b"{" + fields + b"}"
+        return b"".join((source[:-1], b",", fields, b"}"))
+
+
+class BulkShipper:
+    """Buffer documents and ship them through the _bulk API.
+
+    A flush happens when the buffered documents reach max_docs or max_bytes,
+    or when the oldest buffered document is older than max_age seconds.
+
+    Bodies are sent by `concurrency` sender threads, so a slow Elasticsearch
+    never holds up the sample consumer. A body failing with 429/5xx or a
+    transport error is retried `retries` times after a jittered, growing
+    wait. Per request latency, failures and retries are kept in `stats`.
+
+    With a DiskSpool, a body that could not be delivered, or found every
+    sender busy, is spooled and Elasticsearch is left alone for a growing
+    retry wait. Without one the consumer waits for a free sender.
+    The spool is replayed one chunk at a time while senders are idle.
+    """
+    RETRY_WAIT = 5
+    MAX_RETRY_WAIT = 300
+    RETRY_JITTER = 0.5
+    MAX_RETRY_JITTER = 10
+    REPORT_EVERY = 60
+
+    def __init__(self, elkconn, max_docs=500, max_bytes=5 * 1024 * 1024, max_age=5, spool=None,
+                 concurrency=2, retries=3):
+        self.elkconn = elkconn
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.spool = spool
+        self.retries = retries
+        self._retry_at = 0
+        self._retry_wait = self.RETRY_WAIT
+
+        self.encoder = DocEncoder()
+        self._buffer = bytearray()
+        self._docs = 0
+        self._first_added = None
+
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=concurrency,
+                                                               thread_name_prefix="Shipper")
+        self._in_flight = threading.BoundedSemaphore(concurrency)
+        self._futures = set()
+        self._replaying = False
+        self._closed = False
+        # spool, retry wait and stats are shared with the senders
+        self._lock = threading.Lock()
+        self.latency = MetricHistory(1000)
+        self.stats = {'requests': 0, 'failed': 0, 'retries': 0, 'docs': 0, 'spooled': 0, 'dropped': 0}
+        self._reported = time.time()
+
+    def add(self, index, doc, fields=b''):
+        """ buffer doc for index, with the encoder.fields() spliced in """
+        buffer = self._buffer
+        buffer += self.encoder.action(index)
+        buffer += self.encoder.encode(doc, fields)
+        buffer += b"\n"
+        self._docs += 1
+        if self._first_added is None:
+            self._first_added = time.time()
+        if self._docs >= self.max_docs or len(buffer) >= self.max_bytes:
+            self.flush()
+
+    def maybe_flush(self):
+        if self._first_added is not None and time.time() - self._first_added >= self.max_age:
+            self.flush()
+        elif self.spool is not None and not self._replaying and time.time() >= self._retry_at:
+            with self._lock:
+                pending = self.spool.pending()
+            if pending and self._in_flight.acquire(blocking=False):
+                self._replaying = True
+                self.submit(self.replay)
+        if time.time() - self._reported >= self.REPORT_EVERY:
+            self._reported = time.time()
+            logging.info(self.report())
+
+    def flush(self):
+        if not self._docs:
+            return
+        # the body goes to a sender, the buffer is reused for the next one
+        body = bytes(self._buffer)
+        docs = self._docs
+        del self._buffer[:]
+        self._docs = 0
+        self._first_added = None
+
+        if self.spool is not None and time.time() < self._retry_at:
+            self.spool_body(body, docs)
+            return
+        # without a spool the consumer waits for a sender, that is the back pressure
+        if not self._in_flight.acquire(blocking=self.spool is None):
+            logging.warning("every sender is busy, spooled %d docs", docs)
+            self.spool_body(body, docs)
+            return
+        self.submit(self.deliver, body, docs)
+
+    def submit(self, func, *args):
+        """ func on a sender, the caller holds an in-flight slot that func releases """
+        future = self._executor.submit(func, *args)
+        with self._lock:
+            self._futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._futures.discard(future)
+
+    def deliver(self, body, docs):
+        """ send body with retries, spool or drop it when Elasticsearch stays unavailable """
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    wait = random.uniform(0, min(self.RETRY_JITTER * 2 ** attempt, self.MAX_RETRY_JITTER))
+                    self.record(retries=1)
+                    time.sleep(wait)
+                started = time.monotonic()
+                try:
+                    retry, retry_docs, rejected = self.send(body)
+                except (elasticsearch.ApiError, elasticsearch.TransportError) as err:
+                    self.record(latency=time.monotonic() - started, failed=1)
+                    if isinstance(err, elasticsearch.ApiError) and err.status_code != 429 and err.status_code < 500:
+                        logging.error("bulk request rejected, dropped %d docs: %s", docs, err)
+                        self.record(dropped=docs)
+                        return
+                    error = err
+                    continue
+                except Exception as err:
+                    logging.exception(err)
+                    self.record(latency=time.monotonic() - started, failed=1, dropped=docs)
+                    return
+                self.record(latency=time.monotonic() - started, docs=docs - retry_docs - rejected,
+                            dropped=rejected)
+                if retry_docs:
+                    # 429/5xx of single documents come in a 200 response
+                    error = "%d docs rejected with 429/5xx" % retry_docs
+                    logging.warning("%s, retrying them", error)
+                    body, docs = retry, retry_docs
+                    continue
+                with self._lock:
+                    self._retry_wait = self.RETRY_WAIT
+                logging.debug("bulk flushed %d docs", docs)
+                return
+
+            with self._lock:
+                self._retry_at = time.time() + self._retry_wait
+                self._retry_wait = min(self._retry_wait * 2, self.MAX_RETRY_WAIT)
+            if self.spool is None:
+                logging.error("elasticsearch is unavailable, dropped %d docs: %s", docs, error)
+                self.record(dropped=docs)
+            else:
+                logging.error("elasticsearch is unavailable, spooled %d docs: %s", docs, error)
+                self.spool_body(body, docs)
+        finally:
+            self._in_flight.release()
+
+    def spool_body(self, body, docs):
+        with self._lock:
+            self.spool.append(body)
+        self.record(spooled=docs)
+
+    def replay(self):
+        """Ship one chunk of the spool, oldest first."""
+        try:
+            with self._lock:
+                chunk = self.spool.next_chunk(self.max_bytes)
+            if chunk is None:
+                return
+            segment, end, body = chunk
+            if body:
+                started = time.monotonic()
+                try:
+                    retry, retry_docs, rejected = self.send(body)
+                except (elasticsearch.ApiError, elasticsearch.TransportError) as err:
+                    logging.error("spool replay failed: %s", err)
+                    self.record(latency=time.monotonic() - started, failed=1)
+                    with self._lock:
+                        self._retry_at = time.time() + self._retry_wait
+                    return
+                # every document is an action line and a source line
+                docs = body.count(b"\n") // 2
+                self.record(latency=time.monotonic() - started, docs=docs - retry_docs - rejected,
+                            dropped=rejected)
+            with self._lock:
+                self.spool.commit(segment, end)
+            logging.debug("replayed %s up to %d", segment, end)
+            if body and retry_docs:
+                logging.warning("spool replay: %d docs rejected with 429/5xx, spooled again", retry_docs)
+                self.spool_body(retry, retry_docs)
+                with self._lock:
+                    self._retry_at = time.time() + self._retry_wait
+        finally:
+            self._replaying = False
+            self._in_flight.release()
+
+    def send(self, body):
+        """
+        ship body -> (body of the docs to retry, their count, docs rejected for good)
+
+        The items of a _bulk response are in the order of the body, every
+        document is an action line and a source line.
+        """
+        resp = self.elkconn.bulk(operations=body)
+        retry = []
+        rejected = 0
+        if resp.get('errors'):
+            lines = None
+            for n, item in enumerate(resp.get('items', [])):
+                result = item.get('index', {})
+                if 'error' not in result:
+                    continue
+                status = result.get('status', 0)
+                if status == 429 or status >= 500:
+                    if lines is None:
+                        lines = bytes(body).splitlines(True)
+                    retry.extend(lines[2 * n:2 * n + 2])
+                else:
+                    logging.error("bulk index to %s failed: %s", result.get('_index'), result.get('error'))
+                    rejected += 1
+        return b"".join(retry), len(retry) // 2, rejected
+
+    def record(self, latency=None, **counts):
+        with self._lock:
+            if latency is not None:
+                self.stats['requests'] += 1
+                self.latency.add(latency * 1000)
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def report(self):
+        with self._lock:
+            stats = dict(self.stats)
+            latency = (self.latency.min, self.latency.avg, self.latency.p95, self.latency.max) \
+                if self.latency.count else (0, 0, 0, 0)
+        return "bulk requests %(requests)d (failed %(failed)d, retries %(retries)d), " \
+               "docs %(docs)d shipped, %(spooled)d spooled, %(dropped)d dropped" % stats + \
+               ", latency(ms) min/avg/p95/max %.1f/%.1f/%.1f/%.1f" % latency
+
+    def wait(self):
+        """ until every request in flight is done """
+        with self._lock:
+            futures = list(self._futures)
+        concurrent.futures.wait(futures)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self.flush()
+        self._executor.shutdown(wait=True)
+        logging.info(self.report())
+
+
+class DocMapping:
+    """Field types of an index mapping file.
+
+    coerce() converts the values of a document to the declared long, float,
+    boolean or keyword/text type before it is serialized; a value that does
+    not convert is left out, instead of failing the whole document in the
+    _bulk request. Fields matched by a dynamic template 'match' pattern take
+    its type, other fields are left alone. Every element of a list is
+    converted, Elasticsearch takes arrays for any field type.
+    """
+    LONG = frozenset(('long', 'integer', 'short', 'byte', 'unsigned_long'))
+    FLOAT = frozenset(('float', 'double', 'half_float', 'scaled_float'))
+
+    def __init__(self, mapping):
+        self.source = mapping
+        mappings = mapping.get('mappings', {})
+        self.types = dict((k, v.get('type')) for k, v in mappings.get('properties', {}).items())
+        self.patterns = []
+        for template in mappings.get('dynamic_templates', []):
+            for rule in template.values():
+                if 'match' in rule:
+                    self.patterns.append((rule['match'], rule.get('mapping', {}).get('type')))
+        self._converters = {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r') as fp:
+            return cls(json.load(fp))
+
+    @staticmethod
+    def to_long(value):
+        if isinstance(value, str):
+            value = float(value)
+        return int(value)
+
+    @staticmethod
+    def to_bool(value):
+        if isinstance(value, str):
+            return value.strip().upper() in ('1', 'ON', 'YES', 'TRUE')
+        return bool(value)
+
+    def converter(self, k):
+        if k in self._converters:
+            return self._converters[k]
+        kind = self.types.get(k)
+        if kind is None:
+            kind = next((t for pattern, t in self.patterns if fnmatch.fnmatchcase(k, pattern)), None)
+        if kind in self.LONG:
+            converter = self.to_long
+        elif kind in self.FLOAT:
+            converter = float
+        elif kind == 'boolean':
+            converter = self.to_bool
+        elif kind in ('keyword', 'text'):
+            converter = str
+        else:
+            converter = None
+        self._converters[k] = converter
+        return converter
+
+    def coerce(self, doc):
+        """ a new dict with the values of doc in their mapped types """
+        out = {}
+        for k, value in doc.items():
+            converter = self.converter(k)
+            if converter is not None and value is not None:
+                try:
+                    if isinstance(value, (list, tuple)):
+                        value = [converter(item) for item in value if item is not None]
+                    else:
+                        value = converter(value)
+                except (TypeError, ValueError, OverflowError):
+                    logging.debug("%s: %r is not a %s, left out", k, value, self.types.get(k))
+                    continue
+            out[k] = value
+        return out
+
+
+class DeadBand:
+    """Change-only emission of document fields.
+
+    A field is sent when it was never sent, when it moved by more than its
+    threshold since it was last sent, or when it was last sent `heartbeat`
+    seconds ago or more. A threshold is an absolute number or a percentage
+    of the last sent value ('5%'); text fields are sent when they differ.
+    """
+
+    def __init__(self, heartbeat=300, default=0, fields=None):
+        self.heartbeat = heartbeat
+        self.default = self.parse(default)
+        self.thresholds = dict((k, self.parse(v)) for k, v in (fields or {}).items())
+        self._sent = {}
+
+    @staticmethod
+    def parse(threshold):
+        """ 0.5 -> (0.5, False), '5%' -> (0.05, True) """
+        if isinstance(threshold, str) and threshold.strip().endswith('%'):
+            return (float(threshold.strip()[:-1]) / 100, True)
+        return (float(threshold or 0), False)
+
+    def changed(self, k, value, last):
+        if value is None or last is None or not isinstance(value, numbers.Number) \
+           or not isinstance(last, numbers.Number):
+            return value != last
+        threshold, relative = self.thresholds.get(k, self.default)
+        if relative:
+            threshold *= abs(last)
+        return abs(value - last) > threshold if threshold else value != last
+
+    def filter(self, key, doc, now=None):
+        """ fields of doc to send for the server/mode `key`, {} when nothing changed """
+        if now is None:
+            now = time.time()
+        sent = self._sent.setdefault(key, {})
+        out = {}
+        for k, value in doc.items():
+            last = sent.get(k)
+            if last is None or now - last[1] >= self.heartbeat or self.changed(k, value, last[0]):
+                out[k] = value
+                sent[k] = (value, now)
+        return out
+
+
+class Rollup:
+    """Per server aggregates of the status and global samples over fixed periods.
+
+    Every sample is folded into the open bucket of each period, nothing is
+    kept but running values. When a sample falls in the next period, the
+    finished bucket comes out of add() as one document:
+    <field>_min/_max/_avg/_last for levels, <field>_last/_rate and the
+    <field>_rate_min/_rate_max of the per second rates for status counters,
+    and only <field>_last for text. Buckets start on multiples of the period.
+    """
+
+    def __init__(self, periods=(60, 600)):
+        self.periods = tuple(periods)
+        self._buckets = {}
+
+    @staticmethod
+    def period_name(period):
+        return '%dm' % (period // 60) if period % 60 == 0 else '%ds' % period
+
+    def add(self, dbhost, mode, now, values=None, rates=None, extra=None):
+        """
+        values None is a sample of a down server, rates None tells a sample
+        without counters -> [(mode, period, doc)] of the finished buckets
+        """
+        finished = []
+        for period in self.periods:
+            start = now - now % period
+            key = (dbhost, mode, period)
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket['start'] != start:
+                finished.append((mode, period, self.document(bucket)))
+                bucket = None
+            if bucket is None:
+                bucket = self._buckets[key] = {'start': start, 'period': period, 'samples': 0, 'up': 0,
+                                               'fields': {}, 'counters': {}, 'extra': {'dbhost': dbhost}}
+            self.fold(bucket, now, values, rates, extra)
+        return finished
+
+    def fold(self, bucket, now, values, rates, extra):
+        bucket['samples'] += 1
+        # a down server still has its labels, the version it had is kept
+        for k, value in (extra or {}).items():
+            if value is not None:
+                bucket['extra'][k] = value
+        if values is None:
+            return
+        bucket['up'] += 1
+        fields, counters = bucket['fields'], bucket['counters']
+        for k, value in values.items():
+            if isinstance(value, str) or not isinstance(value, numbers.Number):
+                if value is not None:
+                    fields[k] = value
+                continue
+            value = float(value)
+            if rates is not None and is_status_counter(k):
+                counter = counters.get(k)
+                rate = rates.get(k)
+                if counter is None:
+                    counters[k] = [value, now, value, now, rate, rate]
+                    continue
+                counter[2], counter[3] = value, now
+                if rate is not None:
+                    counter[4] = rate if counter[4] is None else min(counter[4], rate)
+                    counter[5] = rate if counter[5] is None else max(counter[5], rate)
+                continue
+            field = fields.get(k)
+            if not isinstance(field, list):
+                fields[k] = [value, value, value, 1, value]
+            else:
+                field[0] = min(field[0], value)
+                field[1] = max(field[1], value)
+                field[2] += value
+                field[3] += 1
+                field[4] = value
+
+    def document(self, bucket):
+        doc = dict(bucket['extra'])
+        doc.update({'timestamp': datetime.utcfromtimestamp(bucket['start']).isoformat()})
+        doc.update({'period': bucket['period']})
+        doc.update({'samples': bucket['samples']})
+        doc.update({'dbup_ratio': round(bucket['up'] / bucket['samples'], 3)})
+        for k, field in bucket['fields'].items():
+            if not isinstance(field, list):
+                doc[k + '_last'] = field
+                continue
+            doc[k + '_min'] = field[0]
+            doc[k + '_max'] = field[1]
+            doc[k + '_avg'] = field[2] / field[3]
+            doc[k + '_last'] = field[4]
+        for k, (first, first_time, last, last_time, rate_min, rate_max) in bucket['counters'].items():
+            doc[k + '_last'] = last
+            if last_time > first_time and last >= first:
+                doc[k + '_rate'] = (last - first) / (last_time - first_time)
+            if rate_min is not None:
+                doc[k + '_rate_min'] = rate_min
+                doc[k + '_rate_max'] = rate_max
+        return doc
+
+    def flush(self):
+        """ the open buckets, partial, at shutdown """
+        finished = [(mode, period, self.document(bucket))
+                    for (dbhost, mode, period), bucket in self._buckets.items() if bucket['up']]
+        self._buckets = {}
+        return finished
+
+
 class SendMode(MySQLStatus):
+    _stamp_second = None
 
     def run(self):
         logging.debug('starting Send the data to Elk')
@@ -569,7 +2982,7 @@ class SendMode(MySQLStatus):
    
         try:
            if(self.sslcert):
-              self.elkconn = Elasticsearch(
+              self.elkconn = elasticsearch.Elasticsearch(
                                 hosts=self.elkconf['elk']['connect']['url'],
                                 ca_certs=self.sslcert,
                                 basic_auth=(self.elkconf['elk']['connect']['user'],
@@ -577,7 +2990,7 @@ class SendMode(MySQLStatus):
                                 request_timeout=10
                              )
            else:
-              self.elkconn = Elasticsearch(
+              self.elkconn = elasticsearch.Elasticsearch(
                                 hosts=self.elkconf['elk']['connect']['url'],
                                 verify_certs=False,
                                 ssl_show_warn=False,
@@ -586,8 +2999,41 @@ class SendMode(MySQLStatus):
                                 request_timeout=10
                              )                            
 
-           print(self.elkconn.info())
-           logging.exception(self.elkconn.info())
+           info = self.elkconn.info()
+           print(info)
+           logging.debug(info)
+
+           spoolconf = self.elkconf['elk'].get('spool') or {}
+           spool = None
+           if spoolconf.get('path'):
+              spool = DiskSpool(spoolconf['path'],
+                                max_bytes=spoolconf.get('max_bytes', 1024 * 1024 * 1024),
+                                segment_bytes=spoolconf.get('segment_bytes', 64 * 1024 * 1024))
+
+           bulkconf = self.elkconf['elk'].get('bulk') or {}
+           self.shipper = BulkShipper(self.elkconn,
+                                      max_docs=bulkconf.get('max_docs', 500),
+                                      max_bytes=bulkconf.get('max_bytes', 5 * 1024 * 1024),
+                                      max_age=bulkconf.get('max_age', 5),
+                                      spool=spool,
+                                      concurrency=bulkconf.get('concurrency', 2),
+                                      retries=bulkconf.get('retries', 3))
+
+           deadbandconf = self.elkconf['elk'].get('deadband') or {}
+           self.deadband = None
+           if deadbandconf.get('enable'):
+              self.deadband = DeadBand(heartbeat=deadbandconf.get('heartbeat', 300),
+                                       default=deadbandconf.get('default', 0),
+                                       fields=deadbandconf.get('fields'))
+
+           rollupconf = self.elkconf['elk'].get('rollup') or {}
+           self.rollup = None
+           self.raw = rollupconf.get('raw', True)
+           if rollupconf.get('periods'):
+              self.rollup = Rollup(rollupconf['periods'])
+
+           self.load_mappings()
+           self.install_templates()
 
            self.mainloop()
         except (KeyboardInterrupt, SystemExit):
@@ -600,70 +3046,310 @@ class SendMode(MySQLStatus):
             self.cleanup()
 
     def mainloop(self):
-        self.variables = self.qthread.mysql_variables
-
         while True:
-            if self.qthread.update == True:
-                self.output_outside()
-                time.sleep(0.1)
-
-    def output_outside(self):
-        self.qthread.update = False
-        if self.qthread.mode == 'status':
-            self.send_update_status()
+            sample = self.samples.get(timeout=self.shipper.max_age)
+            if sample is not None:
+                if not self.over_count(sample):
+                    self.output_outside(sample)
+                    if self.counted(sample):
+                        return
+            self.shipper.maybe_flush()
+
+    def output_outside(self, sample):
+        if getattr(self, 'rollup', None) is not None and sample.mode != 'top':
+            self.send_rollup(sample)
+            if not self.raw:
+                return
+        if sample.data is None:
+            self.send_down(sample)
+        elif sample.mode == 'status':
+            self.send_update_status(sample)
+        elif sample.mode == 'top':
+            self.send_update_top(sample)
         else:
-            self.send_update_global()
-    
-    def send_update_status(self):
-        allstatus = self.qthread.mysql_status
-        host = self.variables.get('hostname')
-        version = self.variables.get('version')
-        status = {}
-
-        for k in self.keywords:
-            status.update({ k : allstatus.get(k) })
-
-        self.todayindex = datetime.utcnow().strftime('mysql-mon-status-%Y%m%d')
-        if not self.elkconn.indices.exists(index=self.todayindex):
-            status_map = {}
-            with open(self.elkconf['elk']['docmap']['status'], 'r') as fp:
-                status_map = json.load(fp)
-            self.elkconn.indices.create(index=self.todayindex, 
-                     settings={"index.mapping.total_fields.limit": 2000}, body=status_map)        
-
-        status.update({'dbhost' : host})
-        status.update({'dbversion' : version})
-        status.update({'timestamp' : datetime.utcnow().isoformat()})
-
-        outdata = json.dumps(status, default=str)
-        self.elkconn.index(index=self.todayindex, body=outdata)
-
-    def send_update_global(self):
-        glob = self.qthread.mysql_global
-        host = self.variables.get('hostname')
-        version = self.variables.get('version')
-
-        self.todayindex = datetime.utcnow().strftime('mysql-mon-global-%Y%m%d')
-        if not self.elkconn.indices.exists(index=self.todayindex):
-            global_map = {}
-            with open(self.elkconf['elk']['docmap']['global'], 'r') as fp:
-                global_map = json.load(fp)
-            self.elkconn.indices.create(index=self.todayindex, body=global_map)
-
-        glob.update({'dbhost' : host})
-        glob.update({'dbversion' : version})
-        glob.update({'timestamp' : datetime.utcnow().isoformat()})
-
-        outdata = json.dumps(glob, default=str)
-        self.elkconn.index(index=self.todayindex, body=outdata)
+            self.send_update_global(sample)
+
+    def send_rollup(self, sample):
+        """ fold the sample into the rollup, ship the finished buckets """
+        mode = 'status' if sample.mode == 'status' else 'global'
+        values = rates = None
+        if sample.data is not None:
+            if mode == 'status':
+                values = dict((k, sample.data.get(k)) for k in self.keywords)
+                rates = sample.rates
+            else:
+                values = sample.data
+        extra = {'dbhost' : sample.dbhost,
+                 'hostname' : sample.variables.get('hostname'),
+                 'dbversion' : sample.variables.get('version')}
+        for mode, period, doc in self.rollup.add(sample.dbhost, mode, time.time(), values, rates, extra):
+            self.send_rollup_doc(mode, period, doc)
+
+    def index_kinds(self):
+        """ (kind, map file, retention) of every index family written, mysql-mon-<kind>-YYYYmmdd """
+        docmap = self.elkconf['elk']['docmap']
+        kinds = [(kind, docmap[kind], 'raw') for kind in ('status', 'global', 'top') if kind in docmap]
+        if getattr(self, 'rollup', None) is not None and 'rollup' in docmap:
+            for period in self.rollup.periods:
+                for mode in ('status', 'global'):
+                    name = Rollup.period_name(period)
+                    kinds.append(('%s-%s' % (name, mode), docmap['rollup'], name))
+        return kinds
+
+    def load_mappings(self):
+        self.mappings = dict((kind, DocMapping.load(mapfile))
+                             for kind, mapfile, _ in self.index_kinds())
+
+    def install_templates(self):
+        """
+        an index template (and ILM delete policy) per index family, once at
+        startup, so Elasticsearch creates each daily index with its mapping
+        on the first bulk write of the day
+        """
+        retention = self.elkconf['elk'].get('retention') or {}
+        policies = set()
+        for kind, mapfile, phase in self.index_kinds():
+            settings = {}
+            if kind == 'status':
+                settings.update({'index.mapping.total_fields.limit' : 2000})
+
+            policy = 'mysql-mon-%s' % phase
+            if retention.get(phase) and policy not in policies:
+                try:
+                    self.elkconn.ilm.put_lifecycle(name=policy, policy={'phases' : {
+                        'hot' : {'actions' : {}},
+                        'delete' : {'min_age' : retention[phase], 'actions' : {'delete' : {}}}}})
+                    policies.add(policy)
+                except elasticsearch.ApiError as err:
+                    logging.warning("ILM policy %s not installed, indices are kept: %s", policy, err)
+            if policy in policies:
+                settings.update({'index.lifecycle.name' : policy})
+
+            self.elkconn.indices.put_index_template(
+                name='mysql-mon-%s' % kind,
+                index_patterns=['mysql-mon-%s-*' % kind],
+                template={'settings' : settings,
+                          'mappings' : self.mappings[kind].source.get('mappings', {})},
+                priority=200)
+            logging.debug("index template mysql-mon-%s (%s)", kind, mapfile)
+
+    def stamp(self):
+        """ (timestamp, YYYYmmdd) of now in UTC, the date formatted once per second """
+        now = time.time()
+        second = int(now)
+        if second != self._stamp_second:
+            tm = time.gmtime(second)
+            self._stamp = (time.strftime('%Y-%m-%dT%H:%M:%S', tm), time.strftime('%Y%m%d', tm))
+            self._stamp_second = second
+        return '%s.%06d' % (self._stamp[0], (now - second) * 1000000), self._stamp[1]
+
+    def send_rollup_doc(self, mode, period, doc):
+        kind = '%s-%s' % (Rollup.period_name(period), mode)
+        self.todayindex = 'mysql-mon-%s-%s' % (kind, self.stamp()[1])
+        self.shipper.add(self.todayindex, self.mappings[kind].coerce(doc))
+
+    def send_update_status(self, sample):
+        variables = sample.variables
+        hostname = variables.get('hostname')
+        version = variables.get('version')
+        status = self.status_values(sample.data, sample.rates, self.keywords)
+        if getattr(self, 'deadband', None) is not None:
+            status = self.deadband.filter((sample.dbhost, 'status'), status)
+            if not status:
+                return
+
+        timestamp, day = self.stamp()
+        self.todayindex = 'mysql-mon-status-' + day
+
+        fields = self.shipper.encoder.fields(timestamp, dbhost=sample.dbhost, hostname=hostname,
+                                             dbup=True, dbversion=version)
+        self.shipper.add(self.todayindex, self.mappings['status'].coerce(status), fields)
+
+    def send_update_global(self, sample):
+        glob = sample.data
+        variables = sample.variables
+        hostname = variables.get('hostname')
+        version = variables.get('version')
+        if getattr(self, 'deadband', None) is not None:
+            glob = self.deadband.filter((sample.dbhost, 'global'), glob)
+            if not glob:
+                return
+
+        timestamp, day = self.stamp()
+        self.todayindex = 'mysql-mon-global-' + day
+
+        # a new dict, sample.data is shared with the other consumers of the sample
+        glob = self.mappings['global'].coerce(glob)
+        fields = self.shipper.encoder.fields(timestamp, dbhost=sample.dbhost, hostname=hostname,
+                                             dbup=True, dbversion=version)
+        self.shipper.add(self.todayindex, glob, fields)
 
         logging.debug(glob)
 
+    def send_update_top(self, sample):
+        variables = sample.variables
+        hostname = variables.get('hostname')
+        version = variables.get('version')
+
+        timestamp, day = self.stamp()
+        self.todayindex = 'mysql-mon-top-' + day
+
+        mapping = self.mappings['top']
+        fields = self.shipper.encoder.fields(timestamp, dbhost=sample.dbhost, hostname=hostname,
+                                             dbup=True, dbversion=version)
+        for rank, item in enumerate(sample.data, 1):
+            doc = mapping.coerce(item)
+            doc.update({'rank' : rank})
+            self.shipper.add(self.todayindex, doc, fields)
+
+    def send_down(self, sample):
+        """ a dbup:false document in the index of the mode, for alerting """
+        mode = sample.mode if sample.mode in ('status', 'top') else 'global'
+        timestamp, day = self.stamp()
+        self.todayindex = 'mysql-mon-' + mode + '-' + day
+
+        fields = self.shipper.encoder.fields(timestamp, dbhost=sample.dbhost,
+                                             hostname=sample.variables.get('hostname'), dbup=False)
+        self.shipper.add(self.todayindex, {}, fields)
+
     def cleanup(self):
+        if hasattr(self, 'shipper') and not self.shipper._closed:
+            try:
+                if getattr(self, 'rollup', None) is not None:
+                    for mode, period, doc in self.rollup.flush():
+                        self.send_rollup_doc(mode, period, doc)
+                self.shipper.close()
+                print(self.shipper.report())
+            except Exception as err:
+                logging.exception(err)
         self.elkconn.close()
         self.qthread.stop = True
 
 
+class ExporterMode(MySQLStatus):
+    """
+    Prometheus/OpenMetrics endpoint. The payload is rendered at most once per
+    collection tick, on the first scrape after new samples came in, and the
+    same bytes are served to every scraper until the next tick.
+    """
+    CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+    def run(self):
+        logging.debug('starting ExporterMode')
+        host, _, port = self.options.exporter.rpartition(':')
+        self._latest = {}
+        self._payload = b"# EOF\n"
+        self._dirty = False
+        self._render_lock = threading.Lock()
+
+        exporter = self
+
+        class Handler(http_server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                payload = exporter.payload()
+                self.send_response(200)
+                self.send_header('Content-Type', exporter.CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                logging.debug(format, *args)
+
+        self.server = http_server.ThreadingHTTPServer((host, int(port)), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="Exporter", daemon=True).start()
+
+        try:
+            self.mainloop()
+        except (KeyboardInterrupt, SystemExit):
+            self.cleanup()
+        except Exception as err:
+            logging.exception(err)
+            self.cleanup()
+            print(err)
+        finally:
+            self.cleanup()
+
+    def mainloop(self):
+        while True:
+            sample = self.samples.get(timeout=1)
+            if sample is not None:
+                with self._render_lock:
+                    self._latest[sample.dbhost] = sample
+                    self._dirty = True
+
+    def payload(self):
+        with self._render_lock:
+            if self._dirty:
+                self._payload = self.render().encode('utf-8')
+                self._dirty = False
+            return self._payload
+
+    def render(self):
+        """ OpenMetrics text: every family once, one sample per host """
+        families = collections.OrderedDict()
+
+        def add(name, kind, help_text, host, value):
+            family = families.get(name)
+            if family is None:
+                family = families[name] = (kind, help_text, [])
+            family[2].append((host, value))
+
+        for host, sample in sorted(self._latest.items()):
+            health = sample.health or {}
+            add('mysql_up', 'gauge', 'The server answered the last collection.', host,
+                0 if sample.data is None else 1)
+            add('mysql_reconnects', 'counter', 'Reconnects to the server.', host, health.get('reconnects', 0))
+            if sample.data is None:
+                continue
+            if sample.mode == 'status':
+                for k, value in sample.data.items():
+                    if not isinstance(value, (int, float)):
+                        continue
+                    name = 'mysql_status_' + self.metric_name(k)
+                    counter = is_status_counter(k)
+                    if self.options.values != 'rate' or not counter:
+                        add(name, 'counter' if counter else 'gauge', 'SHOW GLOBAL STATUS ' + k, host, value)
+                    if self.options.values != 'raw' and k in sample.rates:
+                        add(name + '_per_sec', 'gauge', k + ' per second', host, sample.rates[k])
+            else:
+                for k, value in sample.data.items():
+                    if isinstance(value, str):
+                        value = parse_bytes(value)
+                        if value is None:
+                            continue
+                        value = value / 1024 ** 3
+                    if isinstance(value, numbers.Number):
+                        add('mysql_global_' + self.metric_name(k), 'gauge', k, host, float(value))
+
+        lines = []
+        for name, (kind, help_text, samples) in families.items():
+            lines.append("# TYPE %s %s" % (name, kind))
+            lines.append("# HELP %s %s" % (name, help_text))
+            suffix = '_total' if kind == 'counter' else ''
+            for host, value in samples:
+                lines.append('%s%s{host="%s"} %s' % (name, suffix, self.label_value(host), value))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def metric_name(self, key):
+        return re.sub(r'[^a-z0-9]+', '_', key.lower()).strip('_')
+
+    def label_value(self, value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def cleanup(self):
+        if hasattr(self, 'server'):
+            self.server.shutdown()
+            self.server.server_close()
+            del self.server
+        self.qthread.stop = True
+
+
 if __name__ == '__main__':
     parser = get_args_parser()
     options = parser.parse_args()
@@ -685,8 +3371,17 @@ if __name__ == '__main__':
         nl_hanlder = logging.NullHandler(logging.INFO)
         logging.basicConfig(handlers = [ nl_hanlder ])
 
+    if options.inventory is not None and not options.nonint:
+        print("--inventory is avairable for non-interactive(-n) only")
+        sys.exit()
+
     if(options.nonint):
-        if(options.elk is not None):
+        if(options.exporter is not None):
+            if options.mode not in ('status', 'global'):
+               parser.print_help()
+               sys.exit()
+            monitor = ExporterMode(options)
+        elif(options.elk is not None):
             if options.mode == 'process':
                parser.print_help()
                sys.exit()
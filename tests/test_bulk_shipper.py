@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+BulkShipper: retries, spooling and replay of _bulk requests
+
+  python -m pytest -q tests
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+
+import elasticsearch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bench'))
+
+import mysqlstatus
+from fakes import FakeElasticsearch
+
+
+def body(*numbers):
+    return b"".join(b'{"index":{"_index":"mysql"}}\n{"n":%d}\n' % n for n in numbers)
+
+
+def item(status=201):
+    result = {'_index': 'mysql', 'status': status}
+    if status >= 300:
+        result['error'] = {'type': 'error %d' % status}
+    return {'index': result}
+
+
+class ScriptedElasticsearch(FakeElasticsearch):
+    """Answers every bulk with the next of `answers`, the last one repeats.
+
+    An answer is an exception to raise, a list of item statuses, or None for
+    every item indexed. The documents of every body are kept in `bodies`.
+    """
+
+    def __init__(self, *answers):
+        FakeElasticsearch.__init__(self)
+        self.answers = list(answers)
+        self.bodies = []
+
+    def bulk(self, operations, **kwargs):
+        FakeElasticsearch.bulk(self, operations, **kwargs)
+        lines = bytes(operations).splitlines()
+        self.bodies.append([json.loads(line)['n'] for line in lines[1::2]])
+        answer = self.answers.pop(0) if len(self.answers) > 1 else self.answers[0]
+        if isinstance(answer, Exception):
+            raise answer
+        if answer is None:
+            answer = [201] * (len(lines) // 2)
+        return {'errors': any(status >= 300 for status in answer),
+                'items': [item(status) for status in answer]}
+
+
+class BulkShipperTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def shipper(self, elkconn, spool=False, **kwargs):
+        shipper = mysqlstatus.BulkShipper(elkconn, max_docs=100, concurrency=1,
+                                          spool=mysqlstatus.DiskSpool(self.path) if spool else None,
+                                          **kwargs)
+        shipper.RETRY_JITTER = 0
+        self.addCleanup(shipper.close)
+        return shipper
+
+    def ship(self, shipper, *numbers):
+        for n in numbers:
+            shipper.add('mysql', {'n': n})
+        shipper.flush()
+        shipper.wait()
+
+    def stats(self, shipper, **expected):
+        self.assertEqual(dict((name, shipper.stats[name]) for name in expected), expected)
+
+    def test_shipped(self):
+        elk = ScriptedElasticsearch(None)
+        shipper = self.shipper(elk)
+        self.ship(shipper, 1, 2, 3)
+        self.assertEqual(elk.bodies, [[1, 2, 3]])
+        self.stats(shipper, requests=1, docs=3, retries=0, dropped=0)
+
+    def test_retry_only_the_429_items(self):
+        elk = ScriptedElasticsearch([201, 429, 400, 503], None)
+        with self.assertLogs(level='WARNING'):
+            shipper = self.shipper(elk)
+            self.ship(shipper, 1, 2, 3, 4)
+        self.assertEqual(elk.bodies, [[1, 2, 3, 4], [2, 4]])
+        self.stats(shipper, requests=2, retries=1, docs=3, dropped=1)
+
+    def test_retries_run_out_without_spool(self):
+        elk = ScriptedElasticsearch([201, 429], [429])
+        with self.assertLogs(level='WARNING'):
+            shipper = self.shipper(elk, retries=2)
+            self.ship(shipper, 1, 2)
+        self.assertEqual(elk.bodies, [[1, 2], [2], [2]])
+        self.stats(shipper, requests=3, retries=2, docs=1, dropped=1, spooled=0)
+
+    def test_retries_run_out_to_the_spool(self):
+        elk = ScriptedElasticsearch(elasticsearch.ConnectionError('down'))
+        with self.assertLogs(level='WARNING'):
+            shipper = self.shipper(elk, spool=True, retries=1)
+            self.ship(shipper, 1, 2)
+        self.stats(shipper, requests=2, failed=2, retries=1, docs=0, spooled=2, dropped=0)
+        self.assertTrue(shipper.spool.pending())
+        # Elasticsearch is left alone for a while, the next body goes to the spool
+        self.ship(shipper, 3)
+        self.assertEqual(len(elk.bodies), 2)
+        self.stats(shipper, spooled=3)
+
+    def test_rejected_request_is_dropped(self):
+        error = elasticsearch.BadRequestError('bad', types.SimpleNamespace(status=400), {})
+        elk = ScriptedElasticsearch(error)
+        with self.assertLogs(level='ERROR'):
+            shipper = self.shipper(elk, spool=True)
+            self.ship(shipper, 1, 2)
+        self.assertEqual(len(elk.bodies), 1)
+        self.stats(shipper, failed=1, dropped=2, spooled=0)
+
+    def replay(self, shipper):
+        shipper.maybe_flush()
+        shipper.wait()
+
+    def test_replay_counts_the_docs(self):
+        elk = ScriptedElasticsearch(None)
+        shipper = self.shipper(elk, spool=True)
+        shipper.spool_body(body(1, 2, 3), 3)
+        self.replay(shipper)
+        self.assertEqual(elk.bodies, [[1, 2, 3]])
+        self.assertFalse(shipper.spool.pending())
+        self.stats(shipper, requests=1, docs=3, spooled=3)
+
+    def test_replay_spools_the_429_items_again(self):
+        elk = ScriptedElasticsearch([201, 429, 400])
+        shipper = self.shipper(elk, spool=True)
+        shipper.spool_body(body(1, 2, 3), 3)
+        with self.assertLogs(level='WARNING'):
+            self.replay(shipper)
+        self.stats(shipper, requests=1, docs=1, dropped=1, spooled=4)
+        self.assertEqual(shipper.spool.next_chunk(1024)[2], body(2))
+
+
+if __name__ == '__main__':
+    unittest.main()
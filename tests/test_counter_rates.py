@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+CounterRates: per second rates of the SHOW GLOBAL STATUS counters
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+
+def rows(**status):
+    return [{'Variable_name': name, 'Value': str(value)} for name, value in status.items()]
+
+
+class CounterRatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.slots = mysqlstatus.StatusSlots()
+        self.rates = mysqlstatus.CounterRates(self.slots)
+        self.previous = mysqlstatus.StatusSnapshot(self.slots)
+        self.current = mysqlstatus.StatusSnapshot(self.slots)
+
+    def update(self, before, after, elapsed=10):
+        self.previous.load(rows(**before), now=100)
+        self.current.load(rows(**after), now=100 + elapsed)
+        return dict(self.rates.update(self.current, self.previous))
+
+    def test_counter_rate(self):
+        rates = self.update({'Questions': 1000, 'Uptime': 50}, {'Questions': 1500, 'Uptime': 60})
+        self.assertEqual(rates, {'Questions': 50.0})
+
+    def test_first_sample_has_no_rates(self):
+        self.current.load(rows(Questions=1000), now=100)
+        self.assertEqual(dict(self.rates.update(self.current, None)), {})
+
+    def test_gauges_have_no_rates(self):
+        gauges = {'Threads_connected': 10, 'Innodb_num_open_files': 500,
+                  'Global_connection_memory': 1024, 'Key_blocks_unused': 30,
+                  'Mysqlx_worker_threads': 2, 'Ongoing_anonymous_transaction_count': 1}
+        rates = self.update(gauges, dict((name, value + 1) for name, value in gauges.items()))
+        self.assertEqual(rates, {})
+
+    def test_gauge_going_down(self):
+        rates = self.update({'Innodb_num_open_files': 500}, {'Innodb_num_open_files': 499})
+        self.assertEqual(rates, {})
+
+    def test_counter_going_down_was_reset(self):
+        rates = self.update({'Com_select': 5000, 'Questions': 100},
+                            {'Com_select': 100, 'Questions': 200})
+        self.assertEqual(rates, {'Questions': 10.0})
+
+    def test_counter_wraps_around_2_32(self):
+        rates = self.update({'Key_reads': 2 ** 32 - 100}, {'Key_reads': 100})
+        self.assertEqual(rates, {'Key_reads': 20.0})
+
+    def test_counter_wraps_around_2_64(self):
+        rates = self.update({'Bytes_sent': 2 ** 64 - 2 ** 20}, {'Bytes_sent': 2 ** 20})
+        self.assertEqual(rates, {'Bytes_sent': round(2 ** 21 / 10, 2)})
+
+    def test_restart_skips_the_sample(self):
+        rates = self.update({'Questions': 1000, 'Uptime': 5000}, {'Questions': 10, 'Uptime': 5})
+        self.assertEqual(rates, {})
+
+    def test_flush_status_skips_the_sample(self):
+        rates = self.update({'Questions': 1000, 'Uptime_since_flush_status': 5000},
+                            {'Questions': 10, 'Uptime_since_flush_status': 5})
+        self.assertEqual(rates, {})
+
+    def test_no_time_elapsed(self):
+        self.assertEqual(self.update({'Questions': 1000}, {'Questions': 1500}, elapsed=0), {})
+
+    def test_counter_missing_from_one_sample(self):
+        rates = self.update({'Questions': 1000}, {'Questions': 1500, 'Com_select': 10})
+        self.assertEqual(rates, {'Questions': 50.0})
+
+
+class StatusCounterTest(unittest.TestCase):
+
+    def test_counters(self):
+        for name in ('Questions', 'Com_select', 'Handler_read_rnd_next', 'Innodb_rows_read',
+                     'Innodb_data_reads', 'Innodb_buffer_pool_pages_flushed', 'Opened_tables',
+                     'Bytes_sent', 'Performance_schema_digest_lost'):
+            self.assertTrue(mysqlstatus.is_status_counter(name), name)
+
+    def test_gauges(self):
+        for name in ('Uptime', 'Threads_running', 'Buffer_hit', 'QPS', 'Open_tables',
+                     'Innodb_data_pending_reads', 'Innodb_buffer_pool_pages_free',
+                     'Innodb_row_lock_time_avg', 'Innodb_redo_log_logical_size',
+                     'Acl_cache_items_count', 'Error_log_buffered_bytes', 'Mysqlx_sessions',
+                     'Performance_schema_session_connect_attrs_longest_seen'):
+            self.assertFalse(mysqlstatus.is_status_counter(name), name)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+DeadBand: change-only emission of document fields
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+
+class DeadBandTest(unittest.TestCase):
+
+    def test_parse(self):
+        self.assertEqual(mysqlstatus.DeadBand.parse(0.5), (0.5, False))
+        self.assertEqual(mysqlstatus.DeadBand.parse(' 5% '), (0.05, True))
+        self.assertEqual(mysqlstatus.DeadBand.parse(None), (0, False))
+
+    def test_first_document_is_sent_whole(self):
+        band = mysqlstatus.DeadBand()
+        doc = {'Threads_running': 1, 'role': 'PRIMARY'}
+        self.assertEqual(band.filter('db1', doc, now=0), doc)
+
+    def test_only_changes_are_sent(self):
+        band = mysqlstatus.DeadBand()
+        band.filter('db1', {'Threads_running': 1, 'role': 'PRIMARY'}, now=0)
+        self.assertEqual(band.filter('db1', {'Threads_running': 1, 'role': 'PRIMARY'}, now=10), {})
+        self.assertEqual(band.filter('db1', {'Threads_running': 2, 'role': 'PRIMARY'}, now=20),
+                         {'Threads_running': 2})
+        self.assertEqual(band.filter('db1', {'Threads_running': 2, 'role': 'SECONDARY'}, now=30),
+                         {'role': 'SECONDARY'})
+
+    def test_absolute_threshold(self):
+        band = mysqlstatus.DeadBand(default=5)
+        band.filter('db1', {'Threads_running': 10}, now=0)
+        self.assertEqual(band.filter('db1', {'Threads_running': 15}, now=10), {})
+        self.assertEqual(band.filter('db1', {'Threads_running': 16}, now=20), {'Threads_running': 16})
+
+    def test_relative_threshold_of_the_last_sent_value(self):
+        band = mysqlstatus.DeadBand(fields={'QPS': '10%'})
+        band.filter('db1', {'QPS': 100, 'Threads_running': 1}, now=0)
+        self.assertEqual(band.filter('db1', {'QPS': 109, 'Threads_running': 1}, now=10), {})
+        # the creep is measured from 100, the value last sent
+        self.assertEqual(band.filter('db1', {'QPS': 111, 'Threads_running': 2}, now=20),
+                         {'QPS': 111, 'Threads_running': 2})
+
+    def test_heartbeat(self):
+        band = mysqlstatus.DeadBand(heartbeat=60)
+        band.filter('db1', {'Threads_running': 1}, now=0)
+        self.assertEqual(band.filter('db1', {'Threads_running': 1}, now=59), {})
+        self.assertEqual(band.filter('db1', {'Threads_running': 1}, now=60), {'Threads_running': 1})
+
+    def test_none_and_type_changes(self):
+        band = mysqlstatus.DeadBand(default=100)
+        band.filter('db1', {'Seconds_Behind_Master': 0}, now=0)
+        self.assertEqual(band.filter('db1', {'Seconds_Behind_Master': None}, now=10),
+                         {'Seconds_Behind_Master': None})
+        self.assertEqual(band.filter('db1', {'Seconds_Behind_Master': None}, now=20), {})
+        self.assertEqual(band.filter('db1', {'Seconds_Behind_Master': 'n/a'}, now=30),
+                         {'Seconds_Behind_Master': 'n/a'})
+
+    def test_keys_are_apart(self):
+        band = mysqlstatus.DeadBand()
+        band.filter('db1', {'Threads_running': 1}, now=0)
+        self.assertEqual(band.filter('db2', {'Threads_running': 1}, now=10), {'Threads_running': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
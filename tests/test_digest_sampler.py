@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+DigestSampler: top-N statement digests of the last interval
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+
+def row(digest, count, wait, rows_examined=0, schema='test', seen='2024-01-01 09:00:00'):
+    return {'SCHEMA_NAME': schema, 'DIGEST': digest, 'COUNT_STAR': count,
+            'SUM_TIMER_WAIT': wait, 'SUM_ROWS_EXAMINED': rows_examined, 'LAST_SEEN': seen}
+
+
+class DigestSamplerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sampler = mysqlstatus.DigestSampler(top=2)
+
+    def test_first_tick_has_no_deltas(self):
+        self.assertEqual(self.sampler.update([row('a', 10, 10 ** 9)], now=0), [])
+        self.assertEqual(self.sampler.last_seen, '2024-01-01 09:00:00')
+
+    def test_deltas_of_the_interval(self):
+        self.sampler.update([row('a', 10, 10 ** 9, 100)], now=0)
+        top = self.sampler.update([row('a', 15, 3 * 10 ** 9, 150, seen='2024-01-01 09:00:10')], now=10)
+        self.assertEqual(len(top), 1)
+        self.assertEqual(top[0]['digest'], 'a')
+        self.assertEqual(top[0]['exec_count'], 5)
+        self.assertEqual(top[0]['latency(ms)'], 2.0)
+        self.assertEqual(top[0]['avg_latency(ms)'], 0.4)
+        self.assertEqual(top[0]['rows_examined'], 50)
+        self.assertEqual(top[0]['interval(s)'], 10)
+        self.assertEqual(top[0]['top_by'], ['latency', 'rows_examined', 'executions'])
+        self.assertEqual(self.sampler.last_seen, '2024-01-01 09:00:10')
+
+    def test_not_executed_is_left_out(self):
+        self.sampler.update([row('a', 10, 10 ** 9), row('b', 10, 10 ** 9)], now=0)
+        top = self.sampler.update([row('a', 10, 10 ** 9), row('b', 11, 2 * 10 ** 9)], now=10)
+        self.assertEqual([digest['digest'] for digest in top], ['b'])
+
+    def test_new_digest_and_truncated_table(self):
+        self.sampler.update([row('a', 10, 10 ** 9)], now=0)
+        top = self.sampler.update([row('a', 2, 10 ** 6), row('b', 3, 10 ** 6)], now=10)
+        self.assertEqual(sorted((digest['digest'], digest['exec_count']) for digest in top),
+                         [('a', 2), ('b', 3)])
+
+    def test_rankings_are_bounded(self):
+        self.sampler.update([row(d, 0, 0) for d in 'abcd'], now=0)
+        top = self.sampler.update([row('a', 1, 4 * 10 ** 9), row('b', 1, 3 * 10 ** 9, 1000),
+                                   row('c', 100, 2 * 10 ** 9), row('d', 1, 10 ** 9)], now=10)
+        self.assertEqual([(digest['digest'], digest['top_by']) for digest in top],
+                         [('a', ['latency', 'rows_examined', 'executions']),
+                          ('b', ['latency', 'rows_examined']),
+                          ('c', ['executions'])])
+
+    def test_tracked_digests_are_bounded(self):
+        sampler = mysqlstatus.DigestSampler(track=2)
+        sampler.update([row(d, 1, 1) for d in 'abc'], now=0)
+        # 'a' was forgotten, all of its executions count again
+        top = sampler.update([row(d, 2, 2) for d in 'abc'], now=10)
+        self.assertEqual(dict((digest['digest'], digest['exec_count']) for digest in top),
+                         {'a': 2, 'b': 1, 'c': 1})
+
+    def test_texts(self):
+        self.sampler.update([row('a', 1, 1), row('b', 1, 1)], now=0)
+        top = self.sampler.update([row('a', 2, 2), row('b', 2, 2)], now=10)
+        self.assertEqual(sorted(self.sampler.missing_texts(top)), ['a', 'b'])
+        self.sampler.add_texts(top, {'a': 'SELECT ?'})
+        self.assertEqual(dict((digest['digest'], digest['digest_text']) for digest in top),
+                         {'a': 'SELECT ?', 'b': None})
+        top = self.sampler.update([row('a', 3, 3)], now=20)
+        self.assertEqual(self.sampler.missing_texts(top), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
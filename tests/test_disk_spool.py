@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+DiskSpool: _bulk bodies kept on disk while Elasticsearch is unavailable
+
+  python -m pytest -q tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+
+def body(*numbers):
+    return b"".join(b'{"index":{"_index":"mysql"}}\n{"n":%d}\n' % n for n in numbers)
+
+
+class DiskSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def spool(self, **kwargs):
+        return mysqlstatus.DiskSpool(self.path, **kwargs)
+
+    def test_empty(self):
+        spool = self.spool()
+        self.assertFalse(spool.pending())
+        self.assertIsNone(spool.next_chunk(1024))
+
+    def test_replay_whole_segment(self):
+        spool = self.spool()
+        spool.append(body(1, 2))
+        segment, end, chunk = spool.next_chunk(1024)
+        self.assertEqual(chunk, body(1, 2))
+        spool.commit(segment, end)
+        self.assertFalse(spool.pending())
+
+    def test_chunks_are_whole_documents(self):
+        spool = self.spool()
+        spool.append(body(1, 2, 3))
+        segment, end, chunk = spool.next_chunk(len(body(1)))
+        self.assertEqual(chunk, body(1))
+        spool.commit(segment, end)
+        segment, end, chunk = spool.next_chunk(len(body(1)) + 1)
+        self.assertEqual(chunk, body(2, 3))
+
+    def test_new_segment_when_full(self):
+        spool = self.spool(segment_bytes=len(body(1)))
+        spool.append(body(1))
+        spool.append(body(2))
+        self.assertEqual(len(spool.segments()), 2)
+        segment, end, chunk = spool.next_chunk(1024)
+        self.assertEqual(chunk, body(1))
+        spool.commit(segment, end)
+        self.assertEqual(spool.next_chunk(1024)[2], body(2))
+
+    def test_evicts_oldest_segments(self):
+        spool = self.spool(max_bytes=2 * len(body(1)), segment_bytes=len(body(1)))
+        for n in range(4):
+            spool.append(body(n))
+        self.assertEqual(len(spool.segments()), 2)
+        self.assertEqual(spool.next_chunk(1024)[2], body(2))
+
+    def test_offset_survives_a_restart(self):
+        spool = self.spool()
+        spool.append(body(1, 2))
+        segment, end, chunk = spool.next_chunk(len(body(1)))
+        spool.commit(segment, end)
+
+        spool = self.spool()
+        self.assertEqual(spool.next_chunk(1024)[2], body(2))
+
+    def test_offset_of_an_evicted_segment(self):
+        spool = self.spool(max_bytes=2 * len(body(1, 2)), segment_bytes=len(body(1, 2)))
+        spool.append(body(1, 2))
+        segment, end, chunk = spool.next_chunk(len(body(1)))
+        spool.commit(segment, end)
+        spool.append(body(3, 4))
+        spool.append(body(5, 6))
+        self.assertEqual(spool.next_chunk(1024)[2], body(3, 4))
+
+    def test_offset_forgotten_with_its_segment(self):
+        spool = self.spool()
+        spool.append(body(1, 2))
+        segment, end, chunk = spool.next_chunk(len(body(1)))
+        spool.commit(segment, end)
+        segment, end, chunk = spool.next_chunk(1024)
+        spool.commit(segment, end)
+        # numbering starts over on an empty spool
+        spool.append(body(3, 4))
+        self.assertEqual(spool.next_chunk(1024)[2], body(3, 4))
+        self.assertEqual(self.spool().next_chunk(1024)[2], body(3, 4))
+
+    def test_commit_of_an_evicted_segment(self):
+        spool = self.spool(max_bytes=len(body(1)), segment_bytes=len(body(1)))
+        spool.append(body(1))
+        segment, end, chunk = spool.next_chunk(1024)
+        spool.append(body(2))
+        with self.assertLogs(level='WARNING'):
+            spool.commit(segment, end)
+        self.assertEqual(spool.next_chunk(1024)[2], body(2))
+
+    def test_broken_offset_file(self):
+        spool = self.spool()
+        spool.append(body(1))
+        with open(os.path.join(self.path, mysqlstatus.DiskSpool.OFFSET_FILE), 'w') as fp:
+            fp.write("garbage")
+        with self.assertLogs(level='WARNING'):
+            spool = self.spool()
+        self.assertEqual(spool.next_chunk(1024)[2], body(1))
+
+
+if __name__ == '__main__':
+    unittest.main()
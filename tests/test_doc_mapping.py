@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+DocMapping: documents coerced to the field types of their index mapping
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+MAPPING = {
+    'mappings': {
+        'dynamic_templates': [
+            {'counters': {'match': 'Com_*', 'mapping': {'type': 'long'}}},
+            {'rates': {'match': '*_rate', 'mapping': {'type': 'float'}}},
+        ],
+        'properties': {
+            'Threads_running': {'type': 'integer'},
+            'Buffer_hit': {'type': 'double'},
+            'dbup': {'type': 'boolean'},
+            'dbversion': {'type': 'keyword'},
+            'timestamp': {'type': 'date'},
+        },
+    },
+}
+
+
+class DocMappingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mapping = mysqlstatus.DocMapping(MAPPING)
+
+    def test_declared_types(self):
+        doc = self.mapping.coerce({'Threads_running': '12', 'Buffer_hit': '99.5', 'dbup': 'ON',
+                                   'dbversion': 8, 'timestamp': '2024-01-01T00:00:00'})
+        self.assertEqual(doc, {'Threads_running': 12, 'Buffer_hit': 99.5, 'dbup': True,
+                               'dbversion': '8', 'timestamp': '2024-01-01T00:00:00'})
+
+    def test_long_from_a_decimal_string(self):
+        self.assertEqual(self.mapping.coerce({'Threads_running': '12.0'}), {'Threads_running': 12})
+
+    def test_booleans(self):
+        for value, expected in (('OFF', False), ('yes', True), ('0', False), (1, True), (0, False)):
+            self.assertEqual(self.mapping.coerce({'dbup': value}), {'dbup': expected}, value)
+
+    def test_dynamic_templates(self):
+        doc = self.mapping.coerce({'Com_select': '10', 'Questions_rate': '1.5', 'Uptime': '100'})
+        self.assertEqual(doc, {'Com_select': 10, 'Questions_rate': 1.5, 'Uptime': '100'})
+
+    def test_values_that_do_not_convert_are_left_out(self):
+        doc = self.mapping.coerce({'Threads_running': 'n/a', 'Buffer_hit': float('inf'),
+                                   'Com_select': 'x', 'dbversion': '8.0'})
+        self.assertEqual(doc, {'Buffer_hit': float('inf'), 'dbversion': '8.0'})
+
+    def test_infinity_is_not_a_long(self):
+        self.assertEqual(self.mapping.coerce({'Threads_running': float('inf')}), {})
+
+    def test_none_is_kept(self):
+        self.assertEqual(self.mapping.coerce({'Threads_running': None}), {'Threads_running': None})
+
+    def test_lists(self):
+        doc = self.mapping.coerce({'Threads_running': ['1', None, 2], 'dbversion': (8, '8.0')})
+        self.assertEqual(doc, {'Threads_running': [1, 2], 'dbversion': ['8', '8.0']})
+
+    def test_list_that_does_not_convert_is_left_out(self):
+        self.assertEqual(self.mapping.coerce({'Threads_running': ['1', 'x']}), {})
+
+    def test_empty_mapping(self):
+        doc = {'Threads_running': '12'}
+        self.assertEqual(mysqlstatus.DocMapping({}).coerce(doc), doc)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+PollSchedule: collection cadence on monotonic deadlines
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+
+class PollScheduleTest(unittest.TestCase):
+
+    def schedule(self, interval=1, **kwargs):
+        schedule = mysqlstatus.PollSchedule(interval, **kwargs)
+        schedule.deadline = 100
+        return schedule
+
+    def test_collect_time_does_not_add_up(self):
+        schedule = self.schedule()
+        schedule.done(100, 100.3)
+        self.assertEqual(schedule.deadline, 101)
+        schedule.done(101.05, 101.2)
+        self.assertEqual(schedule.deadline, 102)
+
+    def test_due(self):
+        schedule = self.schedule()
+        self.assertFalse(schedule.due(99.5))
+        self.assertEqual(schedule.sleep_time(99.5), 0.5)
+        self.assertTrue(schedule.due(100))
+        self.assertEqual(schedule.sleep_time(100.5), 0)
+
+    def test_missed_deadlines_are_skipped(self):
+        schedule = self.schedule(max_interval=1)
+        schedule.done(100, 103.5)
+        self.assertEqual(schedule.deadline, 104)
+
+    def test_early_wakeup_restarts_the_cadence(self):
+        schedule = self.schedule()
+        schedule.done(99.5, 99.6)
+        self.assertEqual(schedule.deadline, 100.5)
+
+    def test_slow_collection_backs_off(self):
+        schedule = self.schedule(max_interval=4)
+        with self.assertLogs(level='WARNING'):
+            schedule.done(100, 100.6)
+        self.assertEqual(schedule.interval, 2)
+        with self.assertLogs(level='WARNING'):
+            schedule.done(102, 103.5)
+        self.assertEqual(schedule.interval, 4)
+        # no further than max_interval
+        schedule.done(106, 108.5)
+        self.assertEqual(schedule.interval, 4)
+
+    def test_busy_server_backs_off(self):
+        schedule = self.schedule(max_interval=4, threads_running=20)
+        schedule.done(100, 100.1, threads_running=10)
+        self.assertEqual(schedule.interval, 1)
+        with self.assertLogs(level='WARNING'):
+            schedule.done(101, 101.1, threads_running=30)
+        self.assertEqual(schedule.interval, 2)
+
+    def test_comes_back_by_halves(self):
+        schedule = self.schedule(max_interval=4)
+        schedule.interval = 4
+        with self.assertLogs(level='WARNING'):
+            schedule.done(100, 100.1)
+        self.assertEqual(schedule.interval, 2)
+        with self.assertLogs(level='WARNING'):
+            schedule.done(102, 102.1)
+        self.assertEqual(schedule.interval, 1)
+        schedule.done(103, 103.1)
+        self.assertEqual(schedule.interval, 1)
+
+    def test_stays_while_the_shorter_interval_is_too_busy(self):
+        schedule = self.schedule(max_interval=4)
+        schedule.interval = 4
+        # 1.5s is under half of 4s, over half of 2s
+        schedule.done(100, 101.5)
+        self.assertEqual(schedule.interval, 4)
+
+    def test_minimum_interval(self):
+        schedule = mysqlstatus.PollSchedule(0)
+        self.assertEqual(schedule.interval, mysqlstatus.PollSchedule.MIN_INTERVAL)
+
+
+if __name__ == '__main__':
+    unittest.main()
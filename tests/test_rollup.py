@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Rollup: per server aggregates of the samples over fixed periods
+
+  python -m pytest -q tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import mysqlstatus
+
+
+class RollupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rollup = mysqlstatus.Rollup(periods=(60,))
+
+    def test_period_name(self):
+        self.assertEqual(mysqlstatus.Rollup.period_name(600), '10m')
+        self.assertEqual(mysqlstatus.Rollup.period_name(90), '90s')
+
+    def test_bucket_comes_out_on_the_next_period(self):
+        self.assertEqual(self.rollup.add('db1', 'status', 60, {'Threads_running': 1}, {}), [])
+        self.assertEqual(self.rollup.add('db1', 'status', 119, {'Threads_running': 3}, {}), [])
+        finished = self.rollup.add('db1', 'status', 120, {'Threads_running': 10}, {})
+        self.assertEqual(len(finished), 1)
+        mode, period, doc = finished[0]
+        self.assertEqual((mode, period), ('status', 60))
+        self.assertEqual(doc['dbhost'], 'db1')
+        self.assertEqual(doc['timestamp'], '1970-01-01T00:01:00')
+        self.assertEqual(doc['samples'], 2)
+        self.assertEqual(doc['dbup_ratio'], 1)
+        self.assertEqual((doc['Threads_running_min'], doc['Threads_running_max'],
+                          doc['Threads_running_avg'], doc['Threads_running_last']), (1, 3, 2, 3))
+
+    def test_counters(self):
+        self.rollup.add('db1', 'status', 60, {'Questions': 1000}, {})
+        self.rollup.add('db1', 'status', 70, {'Questions': 1500}, {'Questions': 50.0})
+        self.rollup.add('db1', 'status', 80, {'Questions': 1700}, {'Questions': 20.0})
+        doc = self.rollup.flush()[0][2]
+        self.assertEqual(doc['Questions_last'], 1700)
+        self.assertEqual(doc['Questions_rate'], 35)
+        self.assertEqual((doc['Questions_rate_min'], doc['Questions_rate_max']), (20.0, 50.0))
+        self.assertNotIn('Questions_avg', doc)
+
+    def test_counter_reset_has_no_rate(self):
+        self.rollup.add('db1', 'status', 60, {'Questions': 1000}, {})
+        self.rollup.add('db1', 'status', 70, {'Questions': 10}, {})
+        doc = self.rollup.flush()[0][2]
+        self.assertEqual(doc['Questions_last'], 10)
+        self.assertNotIn('Questions_rate', doc)
+
+    def test_without_rates_counters_are_levels(self):
+        self.rollup.add('db1', 'global', 60, {'Questions': 1000})
+        doc = self.rollup.flush()[0][2]
+        self.assertEqual(doc['Questions_avg'], 1000)
+
+    def test_text_keeps_the_last_value(self):
+        self.rollup.add('db1', 'global', 60, {'role': 'PRIMARY'})
+        self.rollup.add('db1', 'global', 70, {'role': 'SECONDARY'})
+        doc = self.rollup.flush()[0][2]
+        self.assertEqual(doc['role_last'], 'SECONDARY')
+        self.assertNotIn('role_avg', doc)
+
+    def test_down_server(self):
+        self.rollup.add('db1', 'status', 60, {'Threads_running': 1}, {}, extra={'dbversion': '8.0.36'})
+        self.rollup.add('db1', 'status', 70, None, extra={'dbversion': None})
+        finished = self.rollup.add('db1', 'status', 120, None)
+        doc = finished[0][2]
+        self.assertEqual(doc['dbup_ratio'], 0.5)
+        self.assertEqual(doc['dbversion'], '8.0.36')
+        # a bucket of a server down all along comes out with its dbhost
+        doc = self.rollup.add('db1', 'status', 180, None)[0][2]
+        self.assertEqual((doc['dbhost'], doc['samples'], doc['dbup_ratio']), ('db1', 1, 0))
+
+    def test_flush_leaves_out_down_buckets(self):
+        self.rollup.add('db1', 'status', 60, None)
+        self.assertEqual(self.rollup.flush(), [])
+
+    def test_servers_and_periods_are_apart(self):
+        rollup = mysqlstatus.Rollup(periods=(60, 600))
+        rollup.add('db1', 'global', 60, {'Threads_running': 1})
+        rollup.add('db2', 'global', 60, {'Threads_running': 5})
+        finished = rollup.add('db1', 'global', 120, {'Threads_running': 2})
+        self.assertEqual([(period, doc['dbhost']) for mode, period, doc in finished], [(60, 'db1')])
+        self.assertEqual(sorted((period, doc['dbhost']) for mode, period, doc in rollup.flush()),
+                         [(60, 'db1'), (60, 'db2'), (600, 'db1'), (600, 'db2')])
+
+
+if __name__ == '__main__':
+    unittest.main()